@@ -2,15 +2,24 @@ from math import degrees, sin
 from random import randint, shuffle
 from typing import Optional, Union
 
-import PIL.Image
 import arcade
-from arcade.texture import Texture
 from arcade_curtains import KeyFrame, Sequence
 
 from aaaaAAAA import constants
-from aaaaAAAA.procedural_duckies import make_ducky
+from aaaaAAAA.assets import TextureAsset, asset_manager
+from aaaaAAAA.ducky_pool import DuckyPool, render_sprite_ducky
+from aaaaAAAA.ducky_textures import display_size, textures
+from aaaaAAAA.procedural_duckies import DUCKY_SIZE, Seed
 
 DUCKY_SPEED = 240
+# The textures of every lily, in the order of the colors of the game
+LILY_TEXTURES = [
+    [
+        TextureAsset(f"assets/foliage/lillies/png/Lily {lily} - {colour}-512.png", hit_box_algorithm="None")
+        for colour in ('Green', 'Yellow', 'Purple', 'Black')
+    ]
+    for lily in range(1, 5)
+]
 
 
 class PydisSprite(arcade.Sprite):
@@ -31,15 +40,22 @@ class Ducky(PydisSprite):
     """Ducky sprite."""
 
     ducks = arcade.SpriteList()
-
-    def __init__(self, scale: float = 1, *args, **kwargs):
-        ducky = make_ducky()
+    # Renders the upcoming duckies in the background, once a scene has started it
+    pool: Optional[DuckyPool] = None
+
+    def __init__(self, scale: float = 1, *args, seed: Seed = None, **kwargs):
+        # A seeded ducky is rendered on the spot, the ones of the pool are random
+        if self.pool and seed is None:
+            ducky, image = self.pool.take()
+        else:
+            ducky, image = render_sprite_ducky(display_size(scale), seed)
         self.ducky_name = f"{ducky.hat}-{ducky.equipment}-{ducky.outfit}"
 
+        # The texture is already shrunk to about the displayed size, so the sprite only scales it by what's left
+        texture = textures.get(image, scale)
+        scale *= max(DUCKY_SIZE) / max(texture.image.size)
         super().__init__(scale=scale, flipped_horizontally=True, *args, **kwargs)
-        self.texture = Texture(
-            self.ducky_name, ducky.image.transpose(PIL.Image.FLIP_LEFT_RIGHT), hit_box_algorithm="None"
-        )
+        self.texture = texture
 
         self.hat = ducky.hat
         self.equipment = ducky.equipment
@@ -138,10 +154,8 @@ class Lily(PydisSprite):
         super().__init__(scale=scale, *args, **kwargs)
         self.lily = randint(1, 4)
         self.position = position
-        paths = [f"assets/foliage/lillies/png/Lily {self.lily} - {colour}-512.png"
-                 for colour in ('Green', 'Yellow', 'Purple', 'Black')]
-        for path in paths:
-            self.append_texture(arcade.load_texture(path, hit_box_algorithm="None"))
+        for texture in LILY_TEXTURES[self.lily - 1]:
+            self.append_texture(asset_manager.get(texture))
         self.texture = self.textures[0]
         self.lilies.append(self)
 
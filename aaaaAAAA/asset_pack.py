@@ -0,0 +1,213 @@
+import hashlib
+import json
+import mmap
+import struct
+import threading
+import warnings
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+from PIL import Image
+
+ASSETS_PATH = Path("assets/duck-builder")
+PACK_PATH = Path("assets/duck-builder.pack")
+
+# Magic bytes, format version, size of the JSON index that follows and version of the packed assets
+HEADER = struct.Struct(">8sII64s")
+MAGIC = b"DUCKPACK"
+VERSION = 3
+# Every image starts on a boundary of this many bytes, so their pixels can be used straight from the mapping
+ALIGNMENT = 64
+
+
+@lru_cache(maxsize=None)
+def asset_version(root: Path = ASSETS_PATH) -> str:
+    """Hash the content of every asset, so renders and packs made from different assets are never reused."""
+    digest = hashlib.sha256()
+    for path in sorted(root.rglob("*")):
+        if path.is_file():
+            digest.update(path.relative_to(root).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class PackEntry(NamedTuple):
+    """Position and size of an image in the pack."""
+
+    offset: int
+    width: int
+    height: int
+
+
+class AssetPack:
+    """
+    Memory-mapped pack of the duck builder images, already decoded to raw RGBA.
+
+    Images are created on top of the mapping without copying the pixels, so the pages are
+    shared through the OS page cache by every process that uses the same pack.
+
+    The pack can also be read from a buffer holding its bytes, like a block of shared memory,
+    in which case path is only used in error messages.
+    """
+
+    def __init__(
+        self, path: Path = PACK_PATH, root: Path = ASSETS_PATH, buffer: Union[mmap.mmap, memoryview, None] = None
+    ):
+        self.path = path
+        self.root = root
+
+        if buffer is None:
+            with open(path, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmap = buffer
+
+        magic, version, index_size, assets = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} asset pack, rebuild it.")
+        # The asset_version of the images the pack was built from
+        self.asset_version = assets.decode()
+        index = json.loads(bytes(self._mmap[HEADER.size:HEADER.size + index_size]))
+        self.entries = {name: PackEntry(*entry) for name, entry in index.items()}
+
+    def name(self, path: Path) -> Optional[str]:
+        """Return the name of the given path in the pack, or None if it isn't part of it."""
+        try:
+            name = path.relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+        return name
+
+    def __contains__(self, path: Path) -> bool:
+        return self.name(path) in self.entries
+
+    def image(self, path: Path) -> Image.Image:
+        """Return a read-only image backed by the pixels in the pack."""
+        entry = self.entries[self.name(path)]
+        size = entry.width * entry.height * 4
+        buffer = memoryview(self._mmap)[entry.offset:entry.offset + size]
+        return Image.frombuffer("RGBA", (entry.width, entry.height), buffer, "raw", "RGBA", 0, 1)
+
+    def listing(self, directory: Path) -> Optional[list[Path]]:
+        """Return the files directly in the given directory, in the order they were packed, or None if unknown."""
+        prefix = self.name(directory)
+        if prefix is None:
+            return None
+        paths = [self.root / name for name in self.entries if name.rpartition("/")[0] == prefix]
+        return paths or None
+
+
+def build_pack(source: Path = ASSETS_PATH, destination: Path = PACK_PATH) -> int:
+    """Decode every PNG under the source directory and write them to a pack, returning the amount of images."""
+    data, count = pack_assets(source)
+    destination.write_bytes(data)
+    return count
+
+
+def pack_assets(source: Path = ASSETS_PATH) -> tuple[bytearray, int]:
+    """Decode every PNG under the source directory into the bytes of a pack, returned with the amount of images."""
+    paths = []
+    directories = [source]
+    # Random choices depend on the order of the listings, which iterdir leaves up to the filesystem
+    while directories:
+        directory = directories.pop(0)
+        for path in sorted(directory.iterdir()):
+            if path.is_dir():
+                directories.append(path)
+            elif path.suffix == ".png":
+                paths.append(path)
+
+    images = [Image.open(path).convert("RGBA") for path in paths]
+
+    # The offsets depend on the size of the index, so we grow it until it's stable
+    index = {}
+    data_start = 0
+    while True:
+        offset = data_start
+        for path, image in zip(paths, images):
+            index[path.relative_to(source).as_posix()] = (offset, image.width, image.height)
+            offset += -(-image.width * image.height * 4 // ALIGNMENT) * ALIGNMENT
+        encoded_index = json.dumps(index).encode()
+        header_size = HEADER.size + len(encoded_index)
+        if data_start >= header_size:
+            break
+        data_start = -(-header_size // ALIGNMENT) * ALIGNMENT
+
+    data = bytearray(offset)
+    HEADER.pack_into(data, 0, MAGIC, VERSION, len(encoded_index), asset_version(source).encode())
+    data[HEADER.size:header_size] = encoded_index
+    for image, (offset, *_) in zip(images, index.values()):
+        pixels = image.tobytes()
+        data[offset:offset + len(pixels)] = pixels
+
+    return data, len(images)
+
+
+_default_pack: Optional[AssetPack] = None
+_default_pack_checked = False
+_default_pack_lock = threading.Lock()
+
+
+def _load_default_pack() -> Optional[AssetPack]:
+    """Open the pack at the default location, or return None if it is missing or out of date with the assets."""
+    if not PACK_PATH.exists():
+        return None
+
+    try:
+        pack = AssetPack()
+    except ValueError as error:
+        warnings.warn(f"Ignoring the asset pack: {error}", stacklevel=2)
+        return None
+    if pack.asset_version != asset_version(ASSETS_PATH):
+        warnings.warn(
+            f"Ignoring {PACK_PATH}, the assets changed since it was built, rebuild it with `task pack`.", stacklevel=2
+        )
+        return None
+    return pack
+
+
+def default_pack() -> Optional[AssetPack]:
+    """Return the pack at the default location, or None if it hasn't been built or is out of date."""
+    global _default_pack, _default_pack_checked
+
+    with _default_pack_lock:
+        if not _default_pack_checked:
+            _default_pack = _load_default_pack()
+            _default_pack_checked = True
+    return _default_pack
+
+
+def use_pack(pack: Optional[AssetPack]) -> None:
+    """Read the images from the given pack rather than from the one at the default location, or the PNGs if None."""
+    global _default_pack, _default_pack_checked
+
+    with _default_pack_lock:
+        _default_pack = pack
+        _default_pack_checked = True
+
+
+def open_image(path: Path) -> Image.Image:
+    """Return the fully loaded image at the given path, straight from the asset pack if it is in there."""
+    pack = default_pack()
+    if pack and path in pack:
+        return pack.image(path)
+
+    with Image.open(path) as image:
+        image.load()
+    return image
+
+
+def list_directory(directory: Path) -> list[Path]:
+    """Return the images directly in the given directory, using the asset pack if possible."""
+    pack = default_pack()
+    listing = pack and pack.listing(directory)
+    if listing:
+        return listing
+    # Only images are packed in sorted order, so the listing is the same with or without the pack
+    return [path for path in sorted(directory.iterdir()) if path.suffix == ".png" and not path.is_dir()]
+
+
+# If this file is executed we build the asset pack
+if __name__ == "__main__":
+    count = build_pack()
+    print(f"Packed {count} images into {PACK_PATH}")
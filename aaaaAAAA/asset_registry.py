@@ -0,0 +1,81 @@
+import threading
+from pathlib import Path
+from typing import Callable, Hashable, Iterator, Mapping, Optional, TypeVar
+
+from PIL import Image
+
+from aaaaAAAA import instrumentation
+from aaaaAAAA.asset_pack import list_directory, open_image
+
+Key = TypeVar("Key", bound=Hashable)
+
+
+class AssetRegistry:
+    """
+    Thread-safe registry of the duck builder images.
+
+    Nothing is read when the registry is created, every image is decoded the first time it is requested
+    and then kept around, so the file handle is closed and the image can be shared between threads.
+    Images come from the memory-mapped asset pack when it has been built.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.directories: list[str] = []
+
+        self._images: dict[Path, Image.Image] = {}
+        self._listings: dict[str, list[Path]] = {}
+        self._lock = threading.RLock()
+
+    def image(self, path: Path) -> Image.Image:
+        """Return the decoded image at the given path."""
+        if path not in self._images:
+            with self._lock:
+                if path not in self._images:
+                    with instrumentation.timed("decode", path.relative_to(self.path).as_posix()):
+                        self._images[path] = open_image(path)
+        return self._images[path]
+
+    def listing(self, directory: str) -> list[Path]:
+        """Return the paths of the files in the given directory, relative to the registry."""
+        if directory not in self._listings:
+            with self._lock:
+                if directory not in self._listings:
+                    self._listings[directory] = list_directory(self.path / directory)
+        return self._listings[directory]
+
+    def directory(self, directory: str, key: Callable[[Path], Key] = lambda path: path.stem) -> "LazyImages[Key]":
+        """Return the images of a directory, which will also be loaded by preload."""
+        self.directories.append(directory)
+        return LazyImages(self, directory, key)
+
+    def preload(self) -> None:
+        """Decode all the images of the known directories right away."""
+        for directory in self.directories:
+            for path in self.listing(directory):
+                self.image(path)
+
+
+class LazyImages(Mapping[Key, Image.Image]):
+    """The images of a directory of the asset registry, by the key of their path, decoded when looked up."""
+
+    def __init__(self, registry: AssetRegistry, directory: str, key: Callable[[Path], Key]):
+        self.registry = registry
+        self.directory = directory
+        self.key = key
+        self._paths: Optional[dict[Key, Path]] = None
+
+    def paths(self) -> dict[Key, Path]:
+        """Return the path of every image, by key."""
+        if self._paths is None:
+            self._paths = {self.key(path): path for path in self.registry.listing(self.directory)}
+        return self._paths
+
+    def __getitem__(self, key: Key) -> Image.Image:
+        return self.registry.image(self.paths()[key])
+
+    def __iter__(self) -> Iterator[Key]:
+        return iter(self.paths())
+
+    def __len__(self) -> int:
+        return len(self.paths())
@@ -0,0 +1,119 @@
+import threading
+from collections import Counter
+from typing import Iterable, NamedTuple, Union
+
+import arcade
+from PIL import Image
+
+
+class TextureAsset(NamedTuple):
+    """A texture loaded from an image file."""
+
+    path: str
+    hit_box_algorithm: str = "Simple"
+
+    def load(self) -> arcade.Texture:
+        """Decode the texture."""
+        return arcade.load_texture(self.path, hit_box_algorithm=self.hit_box_algorithm)
+
+
+class ScaledTextureAsset(NamedTuple):
+    """A texture shrunk to fit in a fraction of the size of the window."""
+
+    name: str
+    path: str
+    size: float
+    window_size: tuple[int, int]
+
+    def load(self) -> arcade.Texture:
+        """Decode and shrink the texture."""
+        width, height = self.window_size
+        image = Image.open(self.path)
+        image.thumbnail((width * self.size, height * self.size))
+        return arcade.Texture(self.name, image, hit_box_algorithm="Detailed")
+
+
+class SoundAsset(NamedTuple):
+    """A sound, decoded into memory."""
+
+    path: str
+
+    def load(self) -> arcade.Sound:
+        """Decode the sound."""
+        return arcade.load_sound(self.path)
+
+
+Asset = Union[TextureAsset, ScaledTextureAsset, SoundAsset]
+# The assets a scene uses, declared next to it so they can be loaded before it is shown
+Manifest = tuple[Asset, ...]
+
+
+class AssetManager:
+    """
+    Decodes every texture and sound once for the whole process, and hands the same object to every scene.
+
+    Scenes acquire their manifest when they are set up and release it when they are left. Released
+    assets are kept around, so starting a scene again doesn't decode anything, until trim is called
+    to free the ones no scene holds anymore. Assets can be loaded from any thread.
+    """
+
+    def __init__(self):
+        self._assets: dict[tuple[type, Asset], Union[arcade.Texture, arcade.Sound]] = {}
+        self._references: Counter[tuple[type, Asset]] = Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(asset: Asset) -> tuple[type, Asset]:
+        # Named tuples of different types with the same fields compare equal
+        return type(asset), asset
+
+    def get(self, asset: Asset) -> Union[arcade.Texture, arcade.Sound]:
+        """Return the decoded asset, decoding it if it isn't loaded yet."""
+        key = self._key(asset)
+        with self._lock:
+            loaded = self._assets.get(key)
+            if loaded is not None:
+                self.hits += 1
+                return loaded
+            self.misses += 1
+
+        # Decoded without holding the lock, so loading threads don't wait on each other. If two of them
+        # decode the same asset, the first one to finish is kept.
+        loaded = asset.load()
+        with self._lock:
+            return self._assets.setdefault(key, loaded)
+
+    def preload(self, manifest: Iterable[Asset]) -> None:
+        """Decode every asset of the manifest that isn't loaded yet."""
+        for asset in manifest:
+            self.get(asset)
+
+    def acquire(self, manifest: Iterable[Asset]) -> None:
+        """Load the assets of the manifest, and keep them until they are released and trimmed."""
+        for asset in manifest:
+            self.get(asset)
+            with self._lock:
+                self._references[self._key(asset)] += 1
+
+    def release(self, manifest: Iterable[Asset]) -> None:
+        """Give up the assets of a manifest acquired before, they stay loaded until the next trim."""
+        with self._lock:
+            for asset in manifest:
+                key = self._key(asset)
+                self._references[key] -= 1
+                if self._references[key] <= 0:
+                    del self._references[key]
+
+    def trim(self) -> int:
+        """Forget the assets that aren't acquired by any scene, and return how many there were."""
+        with self._lock:
+            unused = [key for key in self._assets if key not in self._references]
+            for key in unused:
+                del self._assets[key]
+            return len(unused)
+
+
+# The assets of every scene of the game
+asset_manager = AssetManager()
@@ -1,6 +1,7 @@
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 720
 SCREEN_TITLE = "aaaaAAAA"
+FONT = "assets/fonts/LuckiestGuy-Regular.ttf"
 
 DUCKS = 21
 POND = 6
@@ -0,0 +1,138 @@
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from aaaaAAAA.ducky_recipes import DuckyRecipe, make_recipe
+from aaaaAAAA.procedural_duckies import (
+    ColorBuckets, DUCKY_SIZE, DuckyColors, LayerStep, ProceduralDucky, Seed, get_engine, level_size
+)
+
+Canvas = Union[Image.Image, np.ndarray]
+Box = tuple[int, int, int, int]
+
+ACCESSORY_KINDS = ("hat", "equipment", "outfit")
+
+
+class EditableDucky:
+    """
+    A ducky whose colors and accessories can be changed one at a time, re-rendering only what changed.
+
+    Before every step of the layer stack is applied, the part of the canvas it covers is saved.
+    When the ducky is edited, the steps from the first one that differs up are undone by pasting
+    those parts back, then composited again, and the steps below it are left as they are. A new hat
+    only redoes the top step, while a new beak color, the bottom layer, redoes them all. The result
+    is always the same as rendering the edited recipe from scratch.
+    """
+
+    def __init__(self, recipe: DuckyRecipe, engine: str = "pillow", size: Optional[int] = None):
+        self.recipe = recipe
+        self.generator = get_engine(engine)(colors=recipe.colors, size=size)
+        self.canvas_size = level_size(DUCKY_SIZE, self.generator.level)
+        # What every applied step was made of, along with the box it covers and what was there before it
+        self.applied: list[tuple[tuple, Box, Canvas]] = []
+        self.ducky = self.render()
+
+    @classmethod
+    def from_seed(
+        cls,
+        seed: Seed = None,
+        color_buckets: Optional[ColorBuckets] = None,
+        engine: str = "pillow",
+        size: Optional[int] = None,
+    ) -> "EditableDucky":
+        """Start from the ducky make_ducky would generate with the same color_buckets and seed."""
+        return cls(make_recipe(color_buckets, seed), engine, size)
+
+    def edit(self, **changes) -> ProceduralDucky:
+        """
+        Change some colors or accessories of the ducky, and return the re-rendered ducky.
+
+        Colors are given by the name of their DuckyColors field, like beak=(255, 128, 0), and accessories
+        by their kind, like hat="santa" or hat=None to take it off.
+        """
+        unknown = set(changes) - {*DuckyColors._fields, *ACCESSORY_KINDS}
+        if unknown:
+            raise ValueError(f"Unknown ducky attributes: {', '.join(sorted(unknown))}.")
+
+        generator = type(self.generator)
+        known = {"hat": generator.hats, "equipment": generator.equipments, "outfit": generator.outfits}
+        for kind, accessories in known.items():
+            if changes.get(kind) is not None and changes[kind] not in accessories:
+                raise ValueError(f"Unknown {kind} {changes[kind]!r}.")
+
+        colors = self.recipe.colors._replace(**{
+            name: tuple(color) for name, color in changes.items() if name in DuckyColors._fields
+        })
+        hat, equipment, outfit = (changes.get(kind, getattr(self.recipe, kind)) for kind in ACCESSORY_KINDS)
+        # The edited ducky doesn't match its seed anymore
+        self.recipe = DuckyRecipe(None, colors, hat, equipment, outfit)
+        self.ducky = self.render()
+        return self.ducky
+
+    def render(self) -> ProceduralDucky:
+        """Composite the steps that changed since the last render, on top of the ones that didn't."""
+        generator, recipe = self.generator, self.recipe
+        generator.colors = recipe.colors
+        steps = generator.layer_steps(*generator.get_accessories(recipe.equipment, recipe.outfit, recipe.hat))
+        # Steps made of the same layers with the same colors on top of the same canvas give the same pixels
+        keys = [tuple((name, recolor) for name, _, recolor in step) for step in steps]
+
+        unchanged = 0
+        while unchanged < min(len(keys), len(self.applied)) and self.applied[unchanged][0] == keys[unchanged]:
+            unchanged += 1
+
+        if unchanged == 0:
+            # Starting over on a blank canvas is cheaper than undoing every step
+            generator.output = _blank(generator.output)
+        else:
+            # The changed steps are undone from the top one down, so every one finds the canvas it covered
+            for _, box, patch in reversed(self.applied[unchanged:]):
+                _paste(generator.output, patch, box)
+        del self.applied[unchanged:]
+
+        for key, step in zip(keys[unchanged:], steps[unchanged:]):
+            box = self.step_box(step)
+            self.applied.append((key, box, _crop(generator.output, box)))
+            generator.apply_step(step)
+
+        image = generator.output_image()
+        if image.size == self.canvas_size:
+            # The image still shares its pixels with the canvas, which the next edit changes in place
+            image = image.copy()
+        return ProceduralDucky(image, recipe.colors, recipe.hat, recipe.equipment, recipe.outfit)
+
+    def step_box(self, step: LayerStep) -> Box:
+        """Return the box of the canvas covered by the layers of a step."""
+        boxes = []
+        for _, layer, _ in step:
+            trimmed, (left, top) = self.generator.get_trimmed_layer(layer, self.generator.level)
+            boxes.append((left, top, left + trimmed.width, top + trimmed.height))
+
+        width, height = self.canvas_size
+        left, top, right, bottom = zip(*boxes)
+        return min(left), min(top), min(max(right), width), min(max(bottom), height)
+
+
+def _blank(canvas: Canvas) -> Canvas:
+    """Return a transparent canvas like the given one."""
+    if isinstance(canvas, np.ndarray):
+        return np.zeros_like(canvas)
+    return Image.new("RGBA", canvas.size, color=(0, 0, 0, 0))
+
+
+def _crop(canvas: Canvas, box: Box) -> Canvas:
+    """Copy the box out of the canvas of either engine."""
+    if isinstance(canvas, np.ndarray):
+        left, top, right, bottom = box
+        return canvas[top:bottom, left:right].copy()
+    return canvas.crop(box)
+
+
+def _paste(canvas: Canvas, patch: Canvas, box: Box) -> None:
+    """Put a patch copied with _crop back into the canvas of either engine."""
+    if isinstance(canvas, np.ndarray):
+        left, top, right, bottom = box
+        canvas[top:bottom, left:right] = patch
+    else:
+        canvas.paste(patch, box[:2])
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from PIL import Image
+
+from aaaaAAAA.procedural_duckies import ProceduralDucky, Seed, make_ducky, preload
+
+DEFAULT_READY = 8
+
+# A ducky, along with its image flipped to face the way the sprites swim
+SpriteDucky = tuple[ProceduralDucky, Image.Image]
+
+
+def render_sprite_ducky(size: Optional[int] = None, seed: Seed = None) -> SpriteDucky:
+    """Render a ducky for a sprite, shrunk to fit in a square of the given size if there is one."""
+    ducky = make_ducky(seed=seed, size=size)
+    return ducky, ducky.image.transpose(Image.FLIP_LEFT_RIGHT)
+
+
+class DuckyPool:
+    """
+    Renders upcoming duckies on background threads, so spawning one doesn't stall the frame.
+
+    Up to ready duckies are kept in a queue, and the threads wait while it is full. Nearly all of
+    the rendering happens in Pillow's C code, which releases the GIL, so the render thread keeps going.
+    If the queue happens to be empty, take renders a ducky right away rather than waiting on the threads.
+    """
+
+    def __init__(
+        self, ready: int = DEFAULT_READY, workers: int = 1, render: Callable[[], SpriteDucky] = render_sprite_ducky
+    ):
+        self.render = render
+        self.queue: queue.Queue[SpriteDucky] = queue.Queue(ready)
+        # Duckies that had to be rendered on the spot, because none was ready
+        self.misses = 0
+
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._produce, name=f"ducky-pool-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _produce(self) -> None:
+        """Keep the queue full until the pool is closed."""
+        preload()
+        while not self._stopped.is_set():
+            ducky = self.render()
+            while not self._stopped.is_set():
+                try:
+                    self.queue.put(ducky, timeout=.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def take(self) -> SpriteDucky:
+        """Return a ready ducky, or render one if there isn't any."""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            self.misses += 1
+            return self.render()
+
+    def warm(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the queue is full, at most timeout seconds, and return whether it is."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.queue.full():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(.01)
+        return True
+
+    def close(self) -> None:
+        """Stop the threads, once they are done with the ducky they are rendering."""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> "DuckyPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,123 @@
+import struct
+from typing import Iterable, Optional, Union
+
+from aaaaAAAA.procedural_duckies import (
+    ColorBuckets, DuckyColors, ProceduralDucky, ProceduralDuckyGenerator, Seed, get_rng, make_ducky
+)
+from aaaaAAAA.render_cache import RenderCache
+
+# The 15 color channels of a serialized recipe, and the length prefixing every recipe packed together
+_RECIPE_COLORS = struct.Struct("<15H")
+_RECIPE_LENGTH = struct.Struct("<H")
+
+
+def make_recipe(color_buckets: Optional[ColorBuckets] = None, seed: Seed = None) -> "DuckyRecipe":
+    """
+    Pick the colors and accessories of a random ducky, without rendering it.
+
+    The random draws are the same as the ones of make_ducky, so rendering the recipe gives
+    the same ducky as make_ducky would with the same color_buckets and seed.
+    """
+    rng = get_rng(seed)
+    colors = ProceduralDuckyGenerator.make_colors(color_buckets, rng)
+    equipment, outfit, hat = ProceduralDuckyGenerator.choose_accessories(rng)
+    return DuckyRecipe(seed if isinstance(seed, (int, str)) else None, colors, hat, equipment, outfit)
+
+
+class DuckyRecipe:
+    """
+    Everything needed to render a ducky, without its image.
+
+    A recipe only takes a few dozen bytes, rather than the 1.2 MB of a rendered ducky, and is made
+    without decoding or compositing anything, so large populations of duckies can be kept around
+    and filtered on their traits. The image is only rendered when asked for with render.
+
+    The seed is the int or string the recipe was made from, if there was one, it isn't needed to render it.
+    """
+
+    __slots__ = ("seed", "colors", "hat", "equipment", "outfit")
+
+    def __init__(
+        self,
+        seed: Union[int, str, None],
+        colors: DuckyColors,
+        hat: Optional[str],
+        equipment: Optional[str],
+        outfit: Optional[str],
+    ):
+        self.seed = seed
+        self.colors = colors
+        self.hat = hat
+        self.equipment = equipment
+        self.outfit = outfit
+
+    def render(
+        self, engine: str = "pillow", size: Optional[int] = None, cache: Optional[RenderCache] = None
+    ) -> ProceduralDucky:
+        """Render the ducky, see make_ducky for the arguments."""
+        return make_ducky(engine, cache=cache, size=size, recipe=self)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the recipe.
+
+        The colors are packed as 16 bit integers, as their channels go up to 256,
+        followed by the accessory names and the seed, separated by null bytes.
+        """
+        seed = "" if self.seed is None else f"{'i' if isinstance(self.seed, int) else 's'}{self.seed}"
+        names = "\0".join((self.hat or "", self.equipment or "", self.outfit or "", seed))
+        return _RECIPE_COLORS.pack(*(channel for color in self.colors for channel in color)) + names.encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DuckyRecipe":
+        """Deserialize a recipe made with to_bytes."""
+        channels = _RECIPE_COLORS.unpack_from(data)
+        colors = DuckyColors(*(channels[i:i + 3] for i in range(0, len(channels), 3)))
+        hat, equipment, outfit, seed = data[_RECIPE_COLORS.size:].decode().split("\0", 3)
+        if not seed:
+            seed = None
+        else:
+            seed = int(seed[1:]) if seed[0] == "i" else seed[1:]
+        return cls(seed, colors, hat or None, equipment or None, outfit or None)
+
+    def _astuple(self) -> tuple:
+        return self.seed, self.colors, self.hat, self.equipment, self.outfit
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DuckyRecipe):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __hash__(self) -> int:
+        return hash(self._astuple())
+
+    def __repr__(self) -> str:
+        return (
+            f"DuckyRecipe(seed={self.seed!r}, colors={self.colors!r}, hat={self.hat!r}, "
+            f"equipment={self.equipment!r}, outfit={self.outfit!r})"
+        )
+
+    def __reduce__(self) -> tuple:
+        # Pickles as the compact serialization
+        return self.from_bytes, (self.to_bytes(),)
+
+
+def pack_recipes(recipes: Iterable[DuckyRecipe]) -> bytes:
+    """Serialize many recipes at once, every one of them prefixed by its length."""
+    packed = bytearray()
+    for recipe in recipes:
+        data = recipe.to_bytes()
+        packed += _RECIPE_LENGTH.pack(len(data)) + data
+    return bytes(packed)
+
+
+def unpack_recipes(data: bytes) -> list[DuckyRecipe]:
+    """Deserialize recipes serialized with pack_recipes."""
+    recipes = []
+    offset = 0
+    while offset < len(data):
+        length, = _RECIPE_LENGTH.unpack_from(data, offset)
+        offset += _RECIPE_LENGTH.size
+        recipes.append(DuckyRecipe.from_bytes(data[offset:offset + length]))
+        offset += length
+    return recipes
@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import weakref
+
+from PIL import Image
+from arcade import Texture
+
+from aaaaAAAA.memory_cache import CacheInfo
+from aaaaAAAA.procedural_duckies import DUCKY_SIZE, fit_image
+
+
+def display_size(scale: float) -> int:
+    """Return the size of the square a ducky drawn at the given scale fits in, in pixels."""
+    return max(round(max(DUCKY_SIZE) * scale), 1)
+
+
+class DuckyTextures:
+    """
+    Hands out the textures of the ducky sprites, one per distinct image, at the size they are drawn at.
+
+    Images are shrunk to their displayed size before anything is uploaded, and named after a hash of
+    their pixels, so two duckies only share a texture when they look the same. The sprite lists pack
+    the textures of their sprites into a single atlas texture, which stays small since every ducky
+    texture is the same few dozen pixels wide.
+
+    Textures are only held weakly: once no sprite uses one anymore it is evicted, and an identical
+    image that comes along later gets a new texture.
+    """
+
+    def __init__(self):
+        self._textures: weakref.WeakValueDictionary[str, Texture] = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(image: Image.Image) -> str:
+        """Hash the size and the pixels of an image."""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f"{image.mode} {image.width}x{image.height}".encode())
+        hasher.update(image.tobytes())
+        return hasher.hexdigest()
+
+    def get(self, image: Image.Image, scale: float) -> Texture:
+        """Return the texture of a full size ducky image, or of one already shrunk, drawn at the given scale."""
+        image = fit_image(image, image.size, display_size(scale))
+        name = f"ducky-{self.digest(image)}"
+        with self._lock:
+            texture = self._textures.get(name)
+            if texture is not None:
+                self.hits += 1
+                return texture
+            self.misses += 1
+            texture = self._textures[name] = Texture(name, image, hit_box_algorithm="None")
+            return texture
+
+    def info(self) -> CacheInfo:
+        """Return the hit and miss counts, and the number and size of the textures still in use."""
+        with self._lock:
+            textures = list(self._textures.values())
+        nbytes = sum(texture.image.width * texture.image.height * 4 for texture in textures)
+        return CacheInfo(self.hits, self.misses, len(textures), nbytes, None)
+
+
+# The textures of every ducky sprite
+textures = DuckyTextures()
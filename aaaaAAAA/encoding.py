@@ -0,0 +1,124 @@
+import io
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple, Optional, Union
+
+from PIL import Image, features
+
+
+class Encoding(NamedTuple):
+    """How to encode an image, as a Pillow format with its save options, or RAW for the bare RGBA pixels."""
+
+    format: str
+    extension: str
+    content_type: str
+    options: dict
+
+
+ENCODINGS = {
+    "png-fast": Encoding("PNG", ".png", "image/png", {"compress_level": 1}),
+    "png": Encoding("PNG", ".png", "image/png", {"compress_level": 6}),
+    "png-small": Encoding("PNG", ".png", "image/png", {"compress_level": 9}),
+    # In lossless mode the quality is the effort spent compressing, and method trades speed for size
+    "webp-fast": Encoding("WEBP", ".webp", "image/webp", {"lossless": True, "quality": 0, "method": 0}),
+    "webp": Encoding("WEBP", ".webp", "image/webp", {"lossless": True, "quality": 80, "method": 4}),
+    # Row after row of RGBA pixels, with no header, so the size has to be known to read them back
+    "raw": Encoding("RAW", ".rgba", "application/octet-stream", {}),
+}
+
+
+def get_encoding(name: str) -> Encoding:
+    """Return the encoding of the given name."""
+    try:
+        encoding = ENCODINGS[name]
+    except KeyError:
+        names = ", ".join(ENCODINGS)
+        raise ValueError(f"Unknown encoding {name!r}, expected one of {names}.") from None
+
+    if encoding.format == "WEBP" and not features.check("webp"):
+        raise ValueError("This Pillow installation was built without WebP support.")
+    return encoding
+
+
+def encode_to(image: Image.Image, file: BinaryIO, encoding: str = "png", **options) -> None:
+    """Encode the image into a file object, options override the ones of the encoding."""
+    encoding = get_encoding(encoding)
+    if encoding.format == "RAW":
+        file.write(image.convert("RGBA").tobytes())
+    else:
+        image.save(file, encoding.format, **{**encoding.options, **options})
+
+
+def encode(image: Image.Image, encoding: str = "png", **options) -> bytes:
+    """Encode the image in memory, options override the ones of the encoding."""
+    if get_encoding(encoding).format == "RAW":
+        # Skips copying the pixels into a buffer first
+        return image.convert("RGBA").tobytes()
+
+    buffer = io.BytesIO()
+    encode_to(image, buffer, encoding, **options)
+    return buffer.getvalue()
+
+
+def save(image: Image.Image, path: Union[str, Path], encoding: Optional[str] = None, **options) -> None:
+    """Save the image to a file, with the encoding matching the extension of the path if none is given."""
+    path = Path(path)
+    if encoding is None:
+        encoding = next((name for name, known in ENCODINGS.items() if known.extension == path.suffix), "png")
+    with open(path, "wb") as file:
+        encode_to(image, file, encoding, **options)
+
+
+class EncodingPool:
+    """
+    Pool of threads encoding images in the background.
+
+    The compression happens in C code that releases the GIL, so the encoding of an image can
+    overlap with the compositing of the next one in the main thread. An encoder can be given in
+    place of an encoding, a stateful one like the compressor of a streamed PNG needs a single
+    worker, so the images are encoded one after the other in the order they were submitted.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        encoding: str = "png",
+        encoder: Optional[Callable[[Image.Image], bytes]] = None,
+        **options
+    ):
+        if encoder is None:
+            get_encoding(encoding)
+            encoder = partial(encode, encoding=encoding, **options)
+        self.encoder = encoder
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="ducky-encoder")
+
+    def submit(self, image: Image.Image) -> "Future[bytes]":
+        """Start encoding the image and return a future of the encoded bytes."""
+        return self.executor.submit(self.encoder, image)
+
+    def encode_all(self, images: Iterable[Image.Image], lookahead: int = 4) -> Iterator[bytes]:
+        """
+        Encode the images in the order they come, yielding the encoded bytes in that same order.
+
+        The images are only pulled from the iterable as the encoded ones are consumed, with at most
+        lookahead of them being encoded at once, so generated images don't pile up in memory.
+        """
+        pending = deque()
+        for image in images:
+            pending.append(self.submit(image))
+            if len(pending) > lookahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self) -> None:
+        """Wait for the pending encodings and stop the threads."""
+        self.executor.shutdown()
+
+    def __enter__(self) -> "EncodingPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
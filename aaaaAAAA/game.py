@@ -1,20 +1,27 @@
 import datetime
 import random
 from enum import IntEnum
+from functools import partial
 from itertools import chain
 from random import choice
 from typing import Optional
 
 import arcade
-from PIL import Image
 from arcade import Texture
 from arcade.gui import UIImageButton, UIManager
 from arcade_curtains import BaseScene, Curtains
 
 from aaaaAAAA import _sprites, constants, menu
+from aaaaAAAA.assets import Manifest, ScaledTextureAsset, TextureAsset, asset_manager
+from aaaaAAAA.ducky_pool import DuckyPool, render_sprite_ducky
+from aaaaAAAA.ducky_textures import display_size
+from aaaaAAAA.music import music
 
 TEXT_RGB = (70, 89, 134)
-FONT = "assets/fonts/LuckiestGuy-Regular.ttf"
+# Scale the duckies are drawn at, relative to their full size
+DUCKY_SCALE = .07
+# Longest time the scene setup waits for the first duckies to be rendered
+DUCKY_POOL_WARMUP = 5
 
 RULES = {
     "Royal Party - Crowns Only": lambda ducky: ducky.hat == "crown",
@@ -45,21 +52,70 @@ class Toxicity(IntEnum):
     DEADLY = 4
 
 
+# The background of every toxicity level
+OVERWORLD_TEXTURES = [
+    TextureAsset(f"assets/overworld/overworld_{level}_no_lilies.png")
+    for level in ("healthy", "decaying", "disgusting", "toxic", "deadly")
+]
+# Variations of the same piece, streamed rather than loaded as assets
+OVERWORLD_MUSIC = [
+    f"assets/audio/music/Overworld - {level}.mp3"
+    for level in ("Healthy", "Decaying", "Disgusting", "Toxic", "Deadly")
+]
+PONDHOUSE_TEXTURE = TextureAsset("assets/overworld/pondhouse/pondhouse_cropped.png")
+TELLER_WINDOW_TEXTURE = TextureAsset("assets/overworld/teller window/teller_window.png")
+GAME_OVER_TEXTURE = TextureAsset("assets/overworld/overworld_deadly.png")
+
+DUCK_SCENE_ASSETS: Manifest = (
+    *OVERWORLD_TEXTURES, PONDHOUSE_TEXTURE, TELLER_WINDOW_TEXTURE,
+    *(texture for textures in _sprites.LILY_TEXTURES for texture in textures),
+)
+GAME_OVER_ASSETS: Manifest = (GAME_OVER_TEXTURE,)
+# The textures of the buttons of the duck scene, by name, with their path and size in relation to the window
+DUCK_SCENE_BUTTONS = {
+    "allow_released": ("assets/overworld/buttons/allow_button.png", 0.18),
+    "allow_pressed": ("assets/overworld/buttons/allow_button_depressed.png", 0.18),
+    "annihilate_released": ("assets/overworld/buttons/annihilate_button.png", 0.18),
+    "annihilate_pressed": ("assets/overworld/buttons/annihilate_button_depressed.png", 0.18),
+}
+
+
 def load_scaled_texture(name: str, path: str, size: float) -> arcade.Texture:
     """Load a texture from a path with a specific size in relation to the window."""
-    window = arcade.get_window()
-    size = (window.width * size, window.height * size)
-    image = Image.open(path)
-    image.thumbnail(size)
-    return arcade.Texture(name, image, hit_box_algorithm="Detailed")
+    return asset_manager.get(ScaledTextureAsset(name, path, size, arcade.get_window().get_size()))
+
+
+def load_button_texture(name: str) -> arcade.Texture:
+    """Load the texture of a button of the duck scene."""
+    return load_scaled_texture(name, *DUCK_SCENE_BUTTONS[name])
+
+
+def duck_scene_manifest() -> Manifest:
+    """Return the assets of the duck scene, with its buttons sized for the current window."""
+    window_size = arcade.get_window().get_size()
+    return DUCK_SCENE_ASSETS + tuple(
+        ScaledTextureAsset(name, path, size, window_size) for name, (path, size) in DUCK_SCENE_BUTTONS.items()
+    )
+
+
+def start_ducky_pool() -> DuckyPool:
+    """Start rendering the duckies of the sprites in the background, if it isn't already."""
+    if _sprites.Ducky.pool is None:
+        _sprites.Ducky.pool = DuckyPool(render=partial(render_sprite_ducky, display_size(DUCKY_SCALE)))
+    return _sprites.Ducky.pool
+
+
+def warm_ducky_pool() -> bool:
+    """Wait until the first duckies are rendered, and return whether they were in time."""
+    return start_ducky_pool().warm(DUCKY_POOL_WARMUP)
 
 
 class AllowButton(UIImageButton):
     """A class representing the button to allow ducks into the pond."""
 
     def __init__(self, scene: "DuckScene"):
-        released = load_scaled_texture("allow_released", "assets/overworld/buttons/allow_button.png", 0.18)
-        pressed = load_scaled_texture("allow_pressed", "assets/overworld/buttons/allow_button_depressed.png", 0.18)
+        released = load_button_texture("allow_released")
+        pressed = load_button_texture("allow_pressed")
         window = arcade.get_window()
         self.scene = scene
         super().__init__(released, press_texture=pressed,
@@ -76,9 +132,8 @@ class AnnihilateButton(UIImageButton):
     """A class representing the button to annihilate ducks."""
 
     def __init__(self, scene: "DuckScene"):
-        released = load_scaled_texture("annihilate_released", "assets/overworld/buttons/annihilate_button.png", 0.18)
-        pressed = load_scaled_texture("annihilate_pressed",
-                                      "assets/overworld/buttons/annihilate_button_depressed.png", 0.18)
+        released = load_button_texture("annihilate_released")
+        pressed = load_button_texture("annihilate_pressed")
         window = arcade.get_window()
         self.scene = scene
         super().__init__(released, press_texture=pressed,
@@ -104,64 +159,62 @@ class DuckScene(BaseScene):
         scale = window.width / constants.SCREEN_WIDTH
 
         self.toxicity = Toxicity.HEALTHY
+        asset_manager.acquire(DUCK_SCENE_ASSETS)
         self.toxicity_assets = [
             {
                 "level": Toxicity.HEALTHY,
                 "lily_color": Colour.GREEN,
-                "overworld": arcade.load_texture("assets/overworld/overworld_healthy_no_lilies.png"),
-                "music": arcade.load_sound("assets/audio/music/Overworld - Healthy.mp3")
+                "overworld": asset_manager.get(OVERWORLD_TEXTURES[Toxicity.HEALTHY]),
+                "music": OVERWORLD_MUSIC[Toxicity.HEALTHY]
             },
             {
                 "level": Toxicity.DECAYING,
                 "lily_color": Colour.YELLOW,
-                "overworld": arcade.load_texture("assets/overworld/overworld_decaying_no_lilies.png"),
-                "music": arcade.load_sound("assets/audio/music/Overworld - Decaying.mp3")
+                "overworld": asset_manager.get(OVERWORLD_TEXTURES[Toxicity.DECAYING]),
+                "music": OVERWORLD_MUSIC[Toxicity.DECAYING]
             },
             {
                 "level": Toxicity.DISGUSTING,
                 "lily_color": Colour.YELLOW,
-                "overworld": arcade.load_texture("assets/overworld/overworld_disgusting_no_lilies.png"),
-                "music": arcade.load_sound("assets/audio/music/Overworld - Disgusting.mp3")
+                "overworld": asset_manager.get(OVERWORLD_TEXTURES[Toxicity.DISGUSTING]),
+                "music": OVERWORLD_MUSIC[Toxicity.DISGUSTING]
             },
             {
                 "level": Toxicity.TOXIC,
                 "lily_color": Colour.PURPLE,
-                "overworld": arcade.load_texture("assets/overworld/overworld_toxic_no_lilies.png"),
-                "music": arcade.load_sound("assets/audio/music/Overworld - Toxic.mp3")
+                "overworld": asset_manager.get(OVERWORLD_TEXTURES[Toxicity.TOXIC]),
+                "music": OVERWORLD_MUSIC[Toxicity.TOXIC]
             },
             {
                 "level": Toxicity.DEADLY,
                 "lily_color": Colour.BLACK,
-                "overworld": arcade.load_texture("assets/overworld/overworld_deadly_no_lilies.png"),
-                "music": arcade.load_sound("assets/audio/music/Overworld - Deadly.mp3")
+                "overworld": asset_manager.get(OVERWORLD_TEXTURES[Toxicity.DEADLY]),
+                "music": OVERWORLD_MUSIC[Toxicity.DEADLY]
             },
         ]
 
-        # Play all the music at the same time, but set volumes to 0 for all but the active one.
-        # This way, hopefully, we'll be able to switch between them smoothly.
-        for asset in self.toxicity_assets:
-            level = asset['level']
-            if level == self.toxicity:
-                player = arcade.play_sound(asset["music"], looping=True)
-            else:
-                player = arcade.play_sound(asset["music"], looping=True, volume=0.0)
+        # Only the music of the current toxicity plays, the next one fades in where it is at
+        music.play(self.toxicity_assets[self.toxicity]["music"])
 
-            self.toxicity_assets[level]["player"] = player
+        self.background = asset_manager.get(OVERWORLD_TEXTURES[Toxicity.HEALTHY])
 
-        self.background = arcade.load_texture("assets/overworld/overworld_healthy_no_lilies.png")
-
-        self.pondhouse = arcade.Sprite("assets/overworld/pondhouse/pondhouse_cropped.png", scale=scale)
+        self.pondhouse = arcade.Sprite(scale=scale)
+        self.pondhouse.texture = asset_manager.get(PONDHOUSE_TEXTURE)
         self.pondhouse.position = (window.width * .66, window.height * .76)
 
-        self.teller_window = arcade.Sprite("assets/overworld/teller window/teller_window.png", scale=scale)
+        self.teller_window = arcade.Sprite(scale=scale)
+        self.teller_window.texture = asset_manager.get(TELLER_WINDOW_TEXTURE)
         self.teller_window.position = (self.teller_window.width / 2, self.teller_window.height / 2)
 
+        # Duckies are rendered ahead of time in the background, so spawning one doesn't cause a hitch
+        warm_ducky_pool()
+
         self.lilies = _sprites.Lily.lilies
         self.ducks = _sprites.Ducky.ducks
         self.path_queued_ducks = arcade.SpriteList()
         self.pond_ducks = arcade.SpriteList()
         self.pondhouse_ducks = arcade.SpriteList()
-        self.leader = _sprites.Ducky(0.07)
+        self.leader = _sprites.Ducky(DUCKY_SCALE)
         self.seq = self.leader.path_seq
 
         for x, y in constants.FOLIAGE_POND:
@@ -191,7 +244,7 @@ class DuckScene(BaseScene):
         if ducks + len(self.pond_ducks) >= constants.DUCKS or ducks >= len(constants.POINTS_HINT):
             arcade.unschedule(self.add_a_ducky)
             return
-        ducky = _sprites.Ducky(0.07)
+        ducky = _sprites.Ducky(DUCKY_SCALE)
         self.events.hover(ducky, ducky.expand)
         self.events.out(ducky, ducky.shrink)
         seq = ducky.path_seq
@@ -214,9 +267,7 @@ class DuckScene(BaseScene):
 
         assets = self.toxicity_assets[self.toxicity]
         lily_color = assets["lily_color"]
-        music_player = assets["player"]
         overworld = assets["overworld"]
-        all_music_players = [asset["player"] for asset in self.toxicity_assets]
 
         # Set the lilies to the right toxicity
         for lily in self.lilies:
@@ -225,12 +276,8 @@ class DuckScene(BaseScene):
         # Set the background
         self.background = overworld
 
-        # Silence the players
-        for player in all_music_players:
-            player.volume = 0.0
-
-        # Set the main player to play
-        music_player.volume = 1.0
+        # Switch to the music of the new toxicity, without skipping a beat
+        music.play(assets["music"], align=True)
 
     def draw_background(self, background: Texture) -> None:
         """Draw the correct background for the current toxicity."""
@@ -252,13 +299,13 @@ class DuckScene(BaseScene):
         name = arcade.draw_text(
             name, 800, 290, TEXT_RGB, 70,
             align="center", anchor_x="center", anchor_y="center",
-            font_name=FONT
+            font_name=constants.FONT
         )
 
         description = arcade.draw_text(
             description, 800, 270, TEXT_RGB, 70,
             align="center", anchor_x="center", anchor_y="top",
-            font_name=FONT
+            font_name=constants.FONT
         )
 
         name.scale = 0.3
@@ -269,7 +316,7 @@ class DuckScene(BaseScene):
         if remaining.total_seconds() <= 0:
             self.end_game()
 
-        arcade.draw_text(str(remaining.seconds), 30, 650, TEXT_RGB, 35, font_name=FONT)
+        arcade.draw_text(str(remaining.seconds), 30, 650, TEXT_RGB, 35, font_name=constants.FONT)
 
         super().draw()
         self.pondhouse.draw()
@@ -389,6 +436,7 @@ class DuckScene(BaseScene):
         # Cleanup
         self.ui_manager.unregister_handlers()
         self.curtains.scenes.pop("swimming_scene")
+        asset_manager.release(DUCK_SCENE_ASSETS)
 
         # Switch over to game over scene
         self.curtains.add_scene("game_over_scene", GameOverView(self.passed, self.failed, self.start))
@@ -467,6 +515,8 @@ class MenuButton(UIImageButton):
         """Call the allow action."""
         self.scene.curtains.scenes.pop("game_over_scene")
         self.scene.ui_manager.unregister_handlers()
+        asset_manager.release(GAME_OVER_ASSETS)
+        music.stop()
 
         self.scene.curtains.add_scene("main_menu", menu.MenuView())
         self.scene.curtains.set_scene("main_menu")
@@ -483,7 +533,8 @@ class GameOverView(BaseScene):
 
     def setup(self) -> None:
         """Setup game over view."""
-        self.background = arcade.load_texture("assets/overworld/overworld_deadly.png")
+        asset_manager.acquire(GAME_OVER_ASSETS)
+        self.background = asset_manager.get(GAME_OVER_TEXTURE)
 
         self.ui_manager = UIManager()
         self.ui_manager.add_ui_element(MenuButton(self))
@@ -506,7 +557,7 @@ class GameOverView(BaseScene):
 
         text = arcade.draw_text(
             message,
-            200, 160, TEXT_RGB, 75, font_name=FONT,
+            200, 160, TEXT_RGB, 75, font_name=constants.FONT,
             align="center", anchor_x="center", anchor_y="center"
         )
 
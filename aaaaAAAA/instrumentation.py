@@ -0,0 +1,141 @@
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Iterator, Optional
+
+from PIL import Image
+
+# How long a stage of a render took, how many Pillow images it created, how many memory blocks Pillow
+# handed out for them, whether freshly allocated or reused from its cache, and how many blocks it freed.
+# The counts are process wide, so stages running at the same time in other threads are counted as well.
+StageTiming = namedtuple("StageTiming", "stage name seconds images blocks freed")
+StageStats = namedtuple("StageStats", "count seconds max_seconds images blocks freed")
+
+
+class Sink(ABC):
+    """Receives the timing of every instrumented stage."""
+
+    @abstractmethod
+    def record(self, timing: StageTiming) -> None:
+        """Handle the timing of a stage."""
+
+
+class StatsSink(Sink):
+    """Keeps count of the time spent and the allocations made by every stage, in memory."""
+
+    def __init__(self):
+        self.stats: dict[tuple[str, str], StageStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, timing: StageTiming) -> None:
+        """Add the timing to the totals of its stage."""
+        key = (timing.stage, timing.name)
+        with self._lock:
+            count, seconds, max_seconds, images, blocks, freed = self.stats.get(key, (0, 0, 0, 0, 0, 0))
+            self.stats[key] = StageStats(
+                count + 1,
+                seconds + timing.seconds,
+                max(max_seconds, timing.seconds),
+                images + timing.images,
+                blocks + timing.blocks,
+                freed + timing.freed,
+            )
+
+    def clear(self) -> None:
+        """Forget all the recorded timings."""
+        with self._lock:
+            self.stats.clear()
+
+    def report(self) -> str:
+        """Return a table of the stages, the ones that took the most time in total first."""
+        lines = [
+            f"{'stage':<10} {'name':<45} {'count':>6} {'total':>10} {'mean':>9} {'max':>9} {'images':>7} {'blocks':>7}"
+        ]
+        for (stage, name), stats in sorted(self.stats.items(), key=lambda item: -item[1].seconds):
+            lines.append(
+                f"{stage:<10} {name:<45} {stats.count:>6} {stats.seconds * 1000:>8.1f}ms"
+                f" {stats.seconds / stats.count * 1000:>7.2f}ms {stats.max_seconds * 1000:>7.2f}ms"
+                f" {stats.images / stats.count:>7.1f} {stats.blocks / stats.count:>7.1f}"
+            )
+        return "\n".join(lines)
+
+
+class CallbackSink(Sink):
+    """Hands every timing to a function, to forward them to a logger or a metrics system."""
+
+    def __init__(self, callback: Callable[[StageTiming], None]):
+        self.callback = callback
+
+    def record(self, timing: StageTiming) -> None:
+        """Call the callback with the timing."""
+        self.callback(timing)
+
+
+class _Timer:
+    """Times a stage and records it in a sink once it is done."""
+
+    __slots__ = ("sink", "stage", "name", "start", "start_stats")
+
+    def __init__(self, sink: Sink, stage: str, name: str):
+        self.sink = sink
+        self.stage = stage
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start_stats = Image.core.get_stats()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        seconds = time.perf_counter() - self.start
+        stats = Image.core.get_stats()
+        self.sink.record(StageTiming(
+            self.stage,
+            self.name,
+            seconds,
+            stats["new_count"] - self.start_stats["new_count"],
+            stats["allocated_blocks"] + stats["reused_blocks"]
+            - self.start_stats["allocated_blocks"] - self.start_stats["reused_blocks"],
+            stats["freed_blocks"] - self.start_stats["freed_blocks"],
+        ))
+
+
+# The sink timings are currently recorded to, instrumentation is disabled while there is none
+sink: Optional[Sink] = None
+_disabled = nullcontext()
+
+
+def timed(stage: str, name: str) -> ContextManager[None]:
+    """Time the code run in the context as the given stage, if instrumentation is enabled."""
+    if sink is None:
+        return _disabled
+    return _Timer(sink, stage, name)
+
+
+@contextmanager
+def instrumented(new_sink: Sink) -> Iterator[Sink]:
+    """Record the timings of every render made within the context, in every thread, to the sink."""
+    global sink
+
+    previous, sink = sink, new_sink
+    try:
+        yield new_sink
+    finally:
+        sink = previous
+
+
+# If this file is executed we render some duckies with their human forms and show where the time went
+if __name__ == "__main__":
+    # The generators record to the module imported under its own name, not to this __main__ one
+    from aaaaAAAA import instrumentation
+    from aaaaAAAA.procedural_duckies import cache_info
+    from aaaaAAAA.procedural_humes import make_ducky_pairs
+
+    with instrumentation.instrumented(instrumentation.StatsSink()) as stats:
+        make_ducky_pairs(int(sys.argv[1]) if len(sys.argv) > 1 else 100, seed=0)
+    print(stats.report())
+    print()
+    for name, info in cache_info().items():
+        print(f"{name} cache: {info.hits} hits, {info.misses} misses, {info.entries} entries, {info.nbytes} bytes")
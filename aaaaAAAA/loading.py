@@ -0,0 +1,79 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable
+
+import arcade
+
+from aaaaAAAA import constants
+from aaaaAAAA.assets import Manifest, ScaledTextureAsset, TextureAsset, asset_manager
+
+LOADING_WORKERS = 2
+# Textures sent to the GPU every frame, so a frame never stalls on many uploads at once
+UPLOADS_PER_FRAME = 2
+
+
+class LoadingView(arcade.View):
+    """
+    Shows the progress of loading a scene, then switches to it.
+
+    The assets of the manifest are decoded and resized on background threads, along with any other
+    task the scene needs done beforehand. The textures are then uploaded to the GPU on the main thread,
+    a few every frame, by drawing them outside of the window. Once everything is done, the view made by
+    make_view is shown; setting up its scenes only picks the loaded assets up.
+    """
+
+    def __init__(
+        self, manifest: Manifest, make_view: Callable[[], arcade.View], tasks: Iterable[Callable[[], object]] = ()
+    ):
+        super().__init__()
+        self.make_view = make_view
+
+        self.executor = ThreadPoolExecutor(LOADING_WORKERS, thread_name_prefix="loading")
+        self.pending: list[Future] = [self.executor.submit(asset_manager.get, asset) for asset in manifest]
+        self.pending += [self.executor.submit(task) for task in tasks]
+        self.uploads: deque[arcade.Texture] = deque()
+
+        # Every asset and task is loaded, and every texture uploaded on top of that
+        textures = sum(isinstance(asset, (TextureAsset, ScaledTextureAsset)) for asset in manifest)
+        self.steps = len(self.pending) + textures
+        self.done = 0
+
+    def on_show_view(self) -> None:
+        """Called when this view is shown."""
+        arcade.set_background_color(arcade.color.WARM_BLACK)
+
+    def on_update(self, delta_time: float) -> None:
+        """Collect what the threads have loaded, and show the scene once it is all uploaded."""
+        for future in [future for future in self.pending if future.done()]:
+            self.pending.remove(future)
+            # Raises here, on the main thread, if loading failed
+            loaded = future.result()
+            if isinstance(loaded, arcade.Texture):
+                self.uploads.append(loaded)
+            self.done += 1
+
+        if not self.pending and not self.uploads:
+            self.executor.shutdown(wait=False)
+            self.window.show_view(self.make_view())
+
+    def on_draw(self) -> None:
+        """Draw the progress bar, then upload the next few textures."""
+        arcade.start_render()
+        width, height = self.window.get_size()
+        progress = self.done / self.steps if self.steps else 1
+
+        arcade.draw_text(
+            "LOADING", width / 2, height / 2 + 40, arcade.color.WHITE, 35,
+            font_name=constants.FONT, anchor_x="center", anchor_y="center"
+        )
+        arcade.draw_rectangle_outline(width / 2, height / 2 - 20, width / 2, 30, arcade.color.WHITE, 3)
+        arcade.draw_rectangle_filled(
+            width / 4 + width / 4 * progress, height / 2 - 20, width / 2 * progress, 30, arcade.color.WHITE
+        )
+
+        for _ in range(min(UPLOADS_PER_FRAME, len(self.uploads))):
+            texture = self.uploads.popleft()
+            # Drawing the texture once creates it on the GPU, it is drawn outside of the window so it isn't seen
+            width, height = texture.image.size
+            texture.draw_sized(-width, -height, width, height)
+            self.done += 1
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Hashable, Optional
+
+CacheInfo = namedtuple("CacheInfo", "hits misses entries nbytes max_bytes")
+
+
+class LRUCache:
+    """Size-bounded LRU cache, which accounts for the memory used by every entry."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[object]:
+        """Return the cached value for the key, or None if it isn't cached."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value: object, nbytes: int) -> None:
+        """Cache the value, evicting the least recently used entries until it fits."""
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            while self._entries and self.nbytes + nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+    def clear(self) -> None:
+        """Empty the cache and reset its statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = self.hits = self.misses = 0
+
+    def info(self) -> CacheInfo:
+        """Return the hit and miss counts and the memory used by the cache."""
+        return CacheInfo(self.hits, self.misses, len(self._entries), self.nbytes, self.max_bytes)
@@ -4,17 +4,24 @@ import arcade
 from arcade.gui import UIGhostFlatButton, UIManager
 from arcade.gui.ui_style import UIStyle
 
-from aaaaAAAA.game import GameView
+from aaaaAAAA import constants
+from aaaaAAAA.assets import Manifest, SoundAsset, TextureAsset, asset_manager
+from aaaaAAAA.game import GameView, duck_scene_manifest, warm_ducky_pool
+from aaaaAAAA.loading import LoadingView
+
+HOVER_SOUND = SoundAsset("assets/audio/fx/plop_1.mp3")
+MENU_BACKGROUND = TextureAsset("assets/title-screen/title_screen_no_buttons.png")
+MENU_MUSIC = SoundAsset("assets/audio/music/Title Screen.mp3")
+MENU_ASSETS: Manifest = (HOVER_SOUND, MENU_BACKGROUND, MENU_MUSIC)
 
 
 # Classes
 class MenuUIManager(UIManager):
     """A custom UI manager to play a hover sound when an element is hovered."""
 
-    hover_sound = arcade.load_sound("assets/audio/fx/plop_1.mp3")
-
     def __init__(self, window: Optional[arcade.Window] = None, attach_callbacks: bool = True, **kwargs):
         super().__init__(window, attach_callbacks, **kwargs)
+        self.hover_sound = asset_manager.get(HOVER_SOUND)
         self.already_hovered = False
 
     def on_mouse_motion(self, x: float, y: float, dx: float, dy: float) -> None:
@@ -50,7 +57,7 @@ class MenuButton(UIGhostFlatButton):
             font_color=arcade.color.WHITE,
             font_color_hover=arcade.color.WHITE,
             font_color_press=arcade.color.WHITE,
-            font_name="assets/fonts/LuckiestGuy-Regular.ttf",
+            font_name=constants.FONT,
             font_size=35
         )
 
@@ -75,12 +82,12 @@ class GameButton(MenuButton):
         In case of multiple UIElements are overlapping, the last added to UIManager will be focused on MOUSE_RELEASE,
         so that only that one will trigger on_click.
 
-        Starts the game by transitioning to the game view.
+        Starts the game by transitioning to the game view, once its assets are loaded.
         """
         super().on_click()
 
-        game_view = GameView()
-        arcade.get_window().show_view(game_view)
+        loading_view = LoadingView(duck_scene_manifest(), GameView, tasks=[warm_ducky_pool])
+        arcade.get_window().show_view(loading_view)
 
 
 class ExitButton(MenuButton):
@@ -102,8 +109,6 @@ class ExitButton(MenuButton):
 class MenuView(arcade.View):
     """Main menu view."""
 
-    background_music = arcade.load_sound("assets/audio/music/Title Screen.mp3")
-
     def __init__(self):
         """Initialize the view."""
         super().__init__()
@@ -116,7 +121,8 @@ class MenuView(arcade.View):
 
     def setup(self) -> None:
         """Sets the background and the buttons."""
-        self.background = arcade.load_texture("assets/title-screen/title_screen_no_buttons.png")
+        asset_manager.acquire(MENU_ASSETS)
+        self.background = asset_manager.get(MENU_BACKGROUND)
         self.ui_manager.purge_ui_elements()
 
         buttons = {"NEW GAME": GameButton, "HIGH SCORES": MenuButton, "SETTINGS": MenuButton, "EXIT GAME": ExitButton}
@@ -127,7 +133,7 @@ class MenuView(arcade.View):
                 button(name, center_x=x_coor, center_y=self.window.height * 2 // 3 - i * 75)
             )
 
-        self.background_player = arcade.play_sound(self.background_music)
+        self.background_player = arcade.play_sound(asset_manager.get(MENU_MUSIC))
 
     def on_draw(self) -> None:
         """
@@ -152,3 +158,4 @@ class MenuView(arcade.View):
         self.ui_manager.unregister_handlers()
         if self.background_player and self.background_player.playing:
             arcade.stop_sound(self.background_player)
+        asset_manager.release(MENU_ASSETS)
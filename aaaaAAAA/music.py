@@ -0,0 +1,101 @@
+from typing import NamedTuple, Optional
+
+import arcade
+from pyglet.media import Player
+
+# Seconds it takes for a track to fade into the next one
+CROSSFADE = 1.5
+
+
+class Playback(NamedTuple):
+    """A track being played."""
+
+    path: str
+    sound: arcade.Sound
+    player: Player
+
+
+class MusicManager:
+    """
+    Plays the background music, streaming it from the disk instead of decoding whole tracks into memory.
+
+    A single track plays at a time, apart from the two a crossfade is between. Switching tracks
+    with align starts the next one where the current one is at, so tracks that are variations of
+    the same piece, like the toxicity levels of the overworld, change without skipping a beat.
+    """
+
+    def __init__(self, crossfade: float = CROSSFADE, volume: float = 1.0):
+        self.crossfade = crossfade
+        self.volume = volume
+        self.current: Optional[Playback] = None
+        # The track fading out, while a crossfade is going on
+        self.fading: Optional[Playback] = None
+        # How far along the crossfade is, from 0 to 1, and the volumes of the two tracks when it started
+        self._progress = 1.0
+        self._start_volumes = (volume, 0.0)
+
+    def position(self) -> float:
+        """Return the position in the current track in seconds, or 0 if nothing plays."""
+        if self.current is None:
+            return 0.0
+        length = self.current.sound.get_length()
+        # Whether the time of a looping player keeps growing past the end of the track or starts over,
+        # wrapping it gives the position in the track. A streamed source may not know its length, in
+        # which case the time is taken as is, which is only right until the track first loops.
+        return self.current.player.time % length if length else self.current.player.time
+
+    def play(self, path: str, loop: bool = True, align: bool = False) -> None:
+        """Fade from the current track to the one at path, starting it where the current one is at if align is set."""
+        if self.current is not None and self.current.path == path:
+            return
+        if self.fading is not None and self.fading.path == path:
+            # Going back to the track that is fading out, so the crossfade is reversed
+            self.current, self.fading = self.fading, self.current
+            self._start_fade()
+            return
+
+        position = self.position() if align else 0.0
+        if self.fading is not None:
+            arcade.stop_sound(self.fading.player)
+        self.fading = self.current
+
+        sound = arcade.Sound(path, streaming=True)
+        player = arcade.play_sound(sound, volume=0.0 if self.fading is not None else self.volume, looping=loop)
+        if position:
+            player.seek(position)
+        self.current = Playback(path, sound, player)
+
+        if self.fading is not None:
+            self._start_fade()
+
+    def _start_fade(self) -> None:
+        """Fade the current track in and the other one out, from the volumes they are at right now."""
+        # A track that was still fading in or out when the crossfade started doesn't jump to full volume first
+        self._start_volumes = (self.current.player.volume, self.fading.player.volume)
+        self._progress = 0.0
+        arcade.unschedule(self._fade)
+        arcade.schedule(self._fade, 1 / 60)
+
+    def _fade(self, delta_time: float) -> None:
+        """Move the crossfade along."""
+        self._progress = min(self._progress + delta_time / self.crossfade, 1.0)
+        current_volume, fading_volume = self._start_volumes
+        self.current.player.volume = current_volume + (self.volume - current_volume) * self._progress
+        self.fading.player.volume = fading_volume * (1 - self._progress)
+        if self._progress == 1.0:
+            arcade.unschedule(self._fade)
+            arcade.stop_sound(self.fading.player)
+            self.fading = None
+
+    def stop(self) -> None:
+        """Stop the music."""
+        arcade.unschedule(self._fade)
+        for playback in (self.current, self.fading):
+            if playback is not None:
+                arcade.stop_sound(playback.player)
+        self.current = self.fading = None
+        self._progress = 1.0
+
+
+# The background music of the whole game
+music = MusicManager()
@@ -1,15 +1,33 @@
+import math
 import random
 import sys
 from collections import namedtuple
 from colorsys import hls_to_rgb
+from itertools import groupby
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional, TYPE_CHECKING, Union
 
-from PIL import Image, ImageChops
+from PIL import Image
+from PIL.Image import ImagePointHandler
+
+from aaaaAAAA import instrumentation
+from aaaaAAAA.asset_registry import AssetRegistry, LazyImages
+from aaaaAAAA.encoding import get_encoding, save
+from aaaaAAAA.memory_cache import CacheInfo, LRUCache
+from aaaaAAAA.render_cache import RenderCache
+if TYPE_CHECKING:
+    # Only imported for the annotations, the recipes render themselves with make_ducky
+    from aaaaAAAA.ducky_recipes import DuckyRecipe
 
 ProceduralDucky = namedtuple("ProceduralDucky", "image colors hat equipment outfit")
 DuckyColors = namedtuple("DuckyColors", "eye_main eye_wing wing body beak")
+ColorBuckets = namedtuple("ColorBuckets", "hue lightness")
 Color = tuple[int, int, int]
+Accessory = tuple[str, Image.Image]
+TrimmedLayer = tuple[Image.Image, tuple[int, int]]
+# Named layers applied together, along with the color they are recolored with, if any
+LayerStep = list[tuple[str, Image.Image, Optional[Color]]]
+Seed = Union[int, str, random.Random, None]
 
 DUCKY_SIZE = (499, 600)
 ASSETS_PATH = Path("assets/duck-builder")
@@ -18,34 +36,135 @@ HAT_CHANCE = .7
 EQUIPMENT_CHANCE = .4
 OUTFIT_CHANCE = .5
 
+LAYER_CACHE_SIZE = 64 * 1024 * 1024
+OVERLAY_CACHE_SIZE = 128 * 1024 * 1024
+
+
+def make_ducky(
+    engine: str = "pillow",
+    color_buckets: Optional[ColorBuckets] = None,
+    seed: Seed = None,
+    cache: Optional[RenderCache] = None,
+    size: Optional[int] = None,
+    recipe: Optional["DuckyRecipe"] = None,
+) -> ProceduralDucky:
+    """
+    Generate a fully random ducky and returns a ProceduralDucky object.
+
+    The engine argument selects the compositing backend, either "pillow" or "numpy".
+    Both produce the exact same pixels, the numpy one takes about half as long per ducky. To make many
+    duckies at once, make_duckies in aaaaAAAA.numpy_duckies shares the work between them on top of that.
+
+    If color_buckets is given, the colors are snapped to that many hues and lightnesses, which
+    limits the number of possible colors so that recolored layers can be reused from the layer cache.
+
+    The seed can be an int or a string, which always gives the same ducky, or a random.Random instance
+    to draw from. When an int or string seed is given along with a render cache, the ducky is stored
+    in the cache and read back from it the next time it is requested.
+
+    If size is given, the ducky is shrunk to fit in a square of that size. It is composited from
+    downscaled copies of the layers, which is a lot cheaper than rendering it in full and resizing it.
+
+    If a recipe is given, the ducky it describes is rendered, and color_buckets and seed are ignored.
+    A recipe always gives the same ducky, so it can be stored in the render cache whatever its seed.
+    """
+    generator = get_engine(engine)
+
+    cacheable = cache is not None and (recipe is not None or isinstance(seed, (int, str)))
+    if cacheable:
+        if recipe is not None:
+            key = ["ducky recipe", recipe.colors, recipe.hat, recipe.equipment, recipe.outfit, size]
+        else:
+            key = ["ducky", seed, color_buckets, size]
+        cached = cache.get(key)
+        if cached:
+            metadata, image = cached
+            colors = DuckyColors(*map(tuple, metadata["colors"]))
+            return ProceduralDucky(image, colors, metadata["hat"], metadata["equipment"], metadata["outfit"])
+
+    if recipe is not None:
+        ducky = generator(colors=recipe.colors, size=size).render(recipe.equipment, recipe.outfit, recipe.hat)
+    else:
+        ducky = generator(color_buckets, rng=get_rng(seed), size=size).generate()
+
+    if cacheable:
+        cache.put(key, ducky.image, {
+            "colors": ducky.colors, "hat": ducky.hat, "equipment": ducky.equipment, "outfit": ducky.outfit
+        })
+    return ducky
+
+
+def get_engine(engine: str) -> type["ProceduralDuckyGenerator"]:
+    """Return the generator class of the given compositing engine."""
+    if engine == "pillow":
+        return ProceduralDuckyGenerator
+    if engine == "numpy":
+        # Only imported when it is used, importing numpy takes longer than importing everything else
+        from aaaaAAAA.numpy_duckies import NumpyDuckyGenerator
+        return NumpyDuckyGenerator
+
+    engines = ", ".join(GENERATOR_ENGINES)
+    raise ValueError(f"Unknown compositing engine {engine!r}, expected one of {engines}.")
+
+
+def get_rng(seed: Seed) -> random.Random:
+    """Return the random generator to use for the seed, a new one is seeded from the OS if there is no seed."""
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
+
+
+# Recolored layers, keyed by engine, layer and color
+layer_cache = LRUCache(LAYER_CACHE_SIZE)
+# Accessories that are drawn right on top of each other, precomposed into a single layer,
+# keyed by what they were made for, the accessories and the mip level
+overlay_cache = LRUCache(OVERLAY_CACHE_SIZE)
 
-def make_ducky() -> ProceduralDucky:
-    """Generate a fully random ducky and returns a ProceduralDucky object."""
-    return ProceduralDuckyGenerator().generate()
 
+def cache_info() -> dict[str, CacheInfo]:
+    """Return the statistics of the caches used while generating, by name."""
+    return {"layers": layer_cache.info(), "overlays": overlay_cache.info()}
 
-def _load_image_assets(file_path: str) -> list[tuple[str, Image]]:
-    return [
-        (filename.stem, Image.open(filename))
-        for filename in (ASSETS_PATH / file_path).iterdir()
-        if not filename.is_dir()
-    ]
+
+assets = AssetRegistry(ASSETS_PATH)
+
+
+def preload() -> None:
+    """Decode all the ducky assets now rather than when the first ducky is generated."""
+    assets.preload()
 
 
 class ProceduralDuckyGenerator:
     """Temporary class used to generate a ducky."""
 
-    templates = {
-        int(filename.name[0]): Image.open(filename) for filename in (ASSETS_PATH / "silverduck templates").iterdir()
-    }
+    templates = assets.directory("silverduck templates", key=lambda path: int(path.name[0]))
+    hats = assets.directory("accessories/hats")
+    equipments = assets.directory("accessories/equipment")
+    outfits = assets.directory("accessories/outfits")
 
-    hats = _load_image_assets("accessories/hats")
-    equipments = _load_image_assets("accessories/equipment")
-    outfits = _load_image_assets("accessories/outfits")
+    # Maps id(layer) and a mip level to the layer and its trimmed version at that level,
+    # the layer is kept around so its id can't be reused
+    trimmed_layers: dict[tuple[int, int], tuple[Image.Image, TrimmedLayer]] = {}
 
-    def __init__(self) -> None:
-        self.output: Image.Image = Image.new("RGBA", DUCKY_SIZE, color=(0, 0, 0, 0))
-        self.colors = self.make_colors()
+    def __init__(
+        self,
+        color_buckets: Optional[ColorBuckets] = None,
+        colors: Optional[DuckyColors] = None,
+        rng: Optional[random.Random] = None,
+        tints: Optional[dict[Color, "Tint"]] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        self.rng = rng or random.Random()
+        # The ducky is composited at the smallest mip level that isn't smaller than the requested size
+        self.size = size
+        self.level = mip_level(DUCKY_SIZE, size)
+        self.output: Image.Image = Image.new("RGBA", level_size(DUCKY_SIZE, self.level), color=(0, 0, 0, 0))
+        if colors is None:
+            with instrumentation.timed("colors", "ducky"):
+                colors = self.make_colors(color_buckets, self.rng)
+        self.colors = colors
+        # Recoloring tints by color, can be shared with other generators using the same colors
+        self.tints = {} if tints is None else tints
 
         self.hat = None
         self.equipment = None
@@ -53,41 +172,141 @@ class ProceduralDuckyGenerator:
 
     def generate(self) -> ProceduralDucky:
         """Actually generate the ducky."""
-        self.apply_layer(self.templates[5], self.colors.beak)
-        self.apply_layer(self.templates[4], self.colors.body)
+        return self.render(*self.choose_accessories(self.rng))
 
-        if random.random() < EQUIPMENT_CHANCE:
-            equipment_type = random.choice(self.equipments)
-            self.apply_layer(equipment_type[1])
-            self.equipment = equipment_type[0]
+    def render(self, equipment: Optional[str], outfit: Optional[str], hat: Optional[str]) -> ProceduralDucky:
+        """Generate the ducky wearing the accessories of the given names, only decoding those."""
+        self.compose(*self.get_accessories(equipment, outfit, hat))
+        return ProceduralDucky(self.output_image(), self.colors, self.hat, self.equipment, self.outfit)
 
-        self.apply_layer(self.templates[3], self.colors.wing)
-        self.apply_layer(self.templates[2], self.colors.eye_wing)
-        self.apply_layer(self.templates[1], self.colors.eye_main)
+    def output_image(self) -> Image.Image:
+        """Return the composited ducky, shrunk to the requested size."""
+        return fit_image(self.output, DUCKY_SIZE, self.size)
+
+    @classmethod
+    def get_accessories(
+        cls, equipment: Optional[str], outfit: Optional[str], hat: Optional[str]
+    ) -> tuple[Optional[Accessory], Optional[Accessory], Optional[Accessory]]:
+        """Return the equipment, outfit and hat of the given names along with their images, None for missing ones."""
+        return tuple(
+            name and (name, accessories[name])
+            for name, accessories in ((equipment, cls.equipments), (outfit, cls.outfits), (hat, cls.hats))
+        )
+
+    @classmethod
+    def choose_accessories(cls, rng: random.Random) -> tuple[Optional[str], Optional[str], Optional[str]]:
+        """Pick the names of the equipment, outfit and hat of a ducky, None for the ones it doesn't wear."""
+        equipment = cls.choose(cls.equipments, rng) if rng.random() < EQUIPMENT_CHANCE else None
+        outfit = cls.choose(cls.outfits, rng) if rng.random() < OUTFIT_CHANCE else None
+        hat = cls.choose(cls.hats, rng) if rng.random() < HAT_CHANCE else None
+        return equipment, outfit, hat
+
+    @staticmethod
+    def choose(accessories: LazyImages[str], rng: random.Random) -> str:
+        """Pick the name of a random accessory, without decoding any."""
+        return rng.choice(list(accessories))
 
-        if random.random() < OUTFIT_CHANCE:
-            outfit_type = random.choice(self.outfits)
-            self.apply_layer(outfit_type[1])
-            self.outfit = outfit_type[0]
+    def compose(self, equipment: Optional[Accessory], outfit: Optional[Accessory], hat: Optional[Accessory]) -> None:
+        """Apply all the layers of a ducky wearing the given accessories to the output."""
+        self.equipment, self.outfit, self.hat = (accessory and accessory[0] for accessory in (equipment, outfit, hat))
+        for step in self.layer_steps(equipment, outfit, hat):
+            self.apply_step(step)
 
-        if random.random() < HAT_CHANCE:
-            hat_type = random.choice(self.hats)
-            self.apply_layer(hat_type[1])
-            self.hat = hat_type[0]
+    def layer_steps(
+        self, equipment: Optional[Accessory], outfit: Optional[Accessory], hat: Optional[Accessory]
+    ) -> list[LayerStep]:
+        """
+        Return the layers of a ducky wearing the given accessories, from the bottom one to the top one.
 
-        return ProceduralDucky(self.output, self.colors, self.hat, self.equipment, self.outfit)
+        The layers are grouped in the steps they are applied in. Accessories drawn right on top of each
+        other, like an outfit and a hat, are applied at once, every other layer is a step of its own.
+        """
+        layers = [
+            ("template 5", self.templates[5], self.colors.beak),
+            ("template 4", self.templates[4], self.colors.body),
+        ]
+        if equipment:
+            layers.append((f"equipment {equipment[0]}", equipment[1], None))
+        layers += [
+            ("template 3", self.templates[3], self.colors.wing),
+            ("template 2", self.templates[2], self.colors.eye_wing),
+            ("template 1", self.templates[1], self.colors.eye_main),
+        ]
+        if outfit:
+            layers.append((f"outfit {outfit[0]}", outfit[1], None))
+        if hat:
+            layers.append((f"hat {hat[0]}", hat[1], None))
+
+        steps = []
+        for recolored, group in groupby(layers, key=lambda layer: layer[2] is not None):
+            if recolored:
+                steps += ([layer] for layer in group)
+            else:
+                steps.append(list(group))
+        return steps
+
+    def apply_step(self, step: LayerStep) -> None:
+        """Add a single layer, or the precomposed overlay of the accessories of a step, on top of the ducky."""
+        if len(step) == 1:
+            name, layer, recolor = step[0]
+            with instrumentation.timed("layer", name):
+                self.apply_layer(layer, recolor)
+        else:
+            names = tuple(name for name, _, _ in step)
+            with instrumentation.timed("layer", "overlay " + ", ".join(names)):
+                self.apply_overlay(names, [layer for _, layer, _ in step])
 
     def apply_layer(self, layer: Image.Image, recolor: Optional[Color] = None) -> None:
         """Add the given layer on top of the ducky. Can be recolored with the recolor argument."""
+        layer, offset = self.get_trimmed_layer(layer, self.level)
         if recolor:
-            layer = ImageChops.multiply(layer, Image.new("RGBA", DUCKY_SIZE, color=recolor))
-        self.output.alpha_composite(layer)
+            layer = self.recolor_layer(layer, recolor)
+        # Only the region covered by the layer is composited
+        self.output.alpha_composite(layer, offset)
+
+    def apply_overlay(self, names: tuple[str, ...], layers: list[Image.Image]) -> None:
+        """Add the given layers on top of the ducky in a single composite, through their precomposed overlay."""
+        key = (type(self), names, self.level)
+        overlay = overlay_cache.get(key)
+        if overlay is None:
+            overlay = make_overlay([self.get_trimmed_layer(layer, self.level) for layer in layers], self.output.size)
+            overlay_cache.put(key, overlay, sum(layer.width * layer.height * 4 for layer, _ in overlay))
+
+        for layer, offset in overlay:
+            self.output.alpha_composite(layer, offset)
+
+    def recolor_layer(self, layer: Image.Image, color: Color) -> Image.Image:
+        """Multiply the layer with the given color, reusing a result from the layer cache if possible."""
+        key = (type(self), id(layer), color)
+        cached = layer_cache.get(key)
+        if cached is None:
+            # The original layer is cached alongside the result so its id can't be reused
+            cached = layer, tint_layer(layer, color, self.tints)
+            layer_cache.put(key, cached, cached[1].width * cached[1].height * len(cached[1].getbands()))
+        return cached[1]
+
+    @classmethod
+    def get_trimmed_layer(cls, layer: Image.Image, level: int = 0) -> TrimmedLayer:
+        """
+        Return the layer at the given mip level, trimmed to the box where it isn't transparent.
+
+        The position of that box is returned along with the trimmed layer.
+        """
+        key = (id(layer), level)
+        if key not in cls.trimmed_layers:
+            cls.trimmed_layers[key] = layer, trim_layer(downscale_layer(layer, level))
+        return cls.trimmed_layers[key][1]
 
     @staticmethod
-    def make_color(hue: float, dark_variant: bool) -> tuple[float, float, float]:
-        """Make a nice hls color to use in a duck."""
+    def make_color(
+        hue: float, dark_variant: bool, buckets: Optional[ColorBuckets] = None, rng: random.Random = random
+    ) -> tuple[float, float, float]:
+        """Make a nice hls color to use in a duck, snapped to the given number of buckets if there are any."""
+        if buckets:
+            hue = _quantize(hue, buckets.hue)
+
         saturation = 1
-        lightness = random.uniform(.7, .85)
+        lightness = rng.uniform(.7, .85)
 
         # green and blue do not like high lightness, so we adjust this depending on how far from blue-green we are
         # hue_fix is the square of the distance between the hue and cyan (0.5 hue)
@@ -98,14 +317,22 @@ class ProceduralDuckyGenerator:
             lightness -= hue_fix * 0.25
         saturation -= hue_fix * 0.1
 
+        if buckets:
+            lightness = _quantize(lightness, buckets.lightness)
+
         return hue, lightness, saturation
 
     @classmethod
-    def make_colors(cls) -> DuckyColors:
-        """Create a matching DuckyColors object."""
-        hue = random.random()
-        dark_variant = random.choice([True, False])
-        eye, wing, body, beak = (cls.make_color(hue, dark_variant) for i in range(4))
+    def make_colors(cls, buckets: Optional[ColorBuckets] = None, rng: random.Random = random) -> DuckyColors:
+        """
+        Create a matching DuckyColors object.
+
+        When buckets are given, every color is derived from quantized hues and lightnesses, so there is
+        only a limited amount of possible DuckyColors.
+        """
+        hue = rng.random()
+        dark_variant = rng.choice([True, False])
+        eye, wing, body, beak = (cls.make_color(hue, dark_variant, buckets, rng) for i in range(4))
 
         # Lower the eye light
         eye_main = (eye[0], max(.1, eye[1] - .7), eye[2])
@@ -119,13 +346,126 @@ class ProceduralDuckyGenerator:
         return DuckyColors(*colors)
 
 
+class Tint(ImagePointHandler):
+    """Lookup table multiplying an RGBA image with an opaque color, like ImageChops.multiply does."""
+
+    def __init__(self, color: Color):
+        # Pillow clamps the channels of the color and then floors the product divided by 255
+        self.table = [value * min(channel, 255) // 255 for channel in (*color, 255) for value in range(256)]
+
+    def point(self, image: Image.Image) -> Image.Image:
+        """Apply the table to the image."""
+        # The table is built once as a flat list of integers, so Image.point has nothing left to convert on 8.1
+        return image.point(self.table)
+
+
+def tint_layer(layer: Image.Image, color: Color, tints: dict[Color, Tint]) -> Image.Image:
+    """
+    Multiply the layer with the given opaque color through its tint.
+
+    The tint is created the first time the color is used and kept in tints, so it only has to be
+    computed once for all the layers recolored with that color.
+    """
+    if color not in tints:
+        tints[color] = Tint(color)
+    return layer.point(tints[color])
+
+
+def precompose(layers: list[TrimmedLayer], size: tuple[int, int]) -> Image.Image:
+    """
+    Composite trimmed layers on a transparent canvas of the given size, from the bottom one to the top one.
+
+    Compositing the result is the same as compositing every layer one after the other, up to
+    rounding, where layers overlap each other.
+    """
+    canvas = Image.new("RGBA", size, color=(0, 0, 0, 0))
+    for layer, offset in layers:
+        canvas.alpha_composite(layer, offset)
+    return canvas
+
+
+def make_overlay(layers: list[TrimmedLayer], size: tuple[int, int]) -> list[TrimmedLayer]:
+    """
+    Return the trimmed layers to composite in place of the given ones, precomposed into a single layer if it pays off.
+
+    Pillow composites every pixel of the box of a layer, so layers far apart from each other, like
+    a hat and a belt, are kept as they are, rather than compositing the mostly empty box around both.
+    """
+    overlay = trim_layer(precompose(layers, size))
+    if overlay[0].width * overlay[0].height > sum(layer.width * layer.height for layer, _ in layers):
+        return layers
+    return [overlay]
+
+
+def trim_layer(layer: Image.Image) -> TrimmedLayer:
+    """Crop the layer to the box where it isn't transparent, and return it with the top left corner of that box."""
+    bbox = layer.getchannel("A").getbbox() or (0, 0, 1, 1)
+    return layer.crop(bbox), bbox[:2]
+
+
+def fit_size(full_size: tuple[int, int], size: Optional[int]) -> tuple[int, int]:
+    """Return the size of an image shrunk to fit in a square of the given size, like Image.thumbnail does."""
+    width, height = full_size
+    if size is None or (size >= width and size >= height):
+        return full_size
+
+    def round_aspect(number: float, key: Callable[[int], float]) -> int:
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if aspect <= 1:
+        return round_aspect(size * aspect, key=lambda n: abs(aspect - n / size)), size
+    return size, round_aspect(size / aspect, key=lambda n: 0 if n == 0 else abs(aspect - size / n))
+
+
+def level_size(full_size: tuple[int, int], level: int) -> tuple[int, int]:
+    """Return the size of an image at the given mip level, every level halving the previous one."""
+    return tuple(-(-length // 2**level) for length in full_size)
+
+
+def mip_level(full_size: tuple[int, int], size: Optional[int]) -> int:
+    """Return the smallest mip level that is still at least as large as the image shrunk to the given size."""
+    target = fit_size(full_size, size)
+    level = 0
+    while max(level_size(full_size, level)) > 1 and all(
+        length >= minimum for length, minimum in zip(level_size(full_size, level + 1), target)
+    ):
+        level += 1
+    return level
+
+
+def downscale_layer(layer: Image.Image, level: int) -> Image.Image:
+    """Return the layer at the given mip level."""
+    if level == 0:
+        return layer
+    # Pillow premultiplies the alpha when resizing RGBA images, so transparent pixels don't bleed their color
+    return layer.resize(level_size(layer.size, level), Image.BOX)
+
+
+def fit_image(image: Image.Image, full_size: tuple[int, int], size: Optional[int]) -> Image.Image:
+    """Resize an image composited at a mip level to the final size of an image of full_size shrunk to size."""
+    target = fit_size(full_size, size)
+    if image.size == target:
+        return image
+    return image.resize(target, Image.LANCZOS)
+
+
+def _quantize(value: float, buckets: int) -> float:
+    """Snap a value between 0 and 1 to the closest of the given number of evenly spaced steps."""
+    return round(value * buckets) / buckets
+
+
+# The numpy engine is in aaaaAAAA.numpy_duckies
+GENERATOR_ENGINES = ("pillow", "numpy")
+
+
 # If this file is executed we generate a random ducky and save it to disk
 # A second argument can be given to seed the duck (that sounds a bit weird doesn't it)
+# and a third one to pick the encoding it's saved with, out of the ones of aaaaAAAA.encoding
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        random.seed(sys.argv[1])
-
-    ducky = make_ducky()
+    ducky = make_ducky(seed=sys.argv[1] if len(sys.argv) > 1 else None)
     print(*("{0}: {1}".format(key, value) for key, value in ducky._asdict().items()), sep="\n")
-    ducky.image.save("ducky.png")
-    print("Ducky saved to disk!")
+    encoding = sys.argv[2] if len(sys.argv) > 2 else "png"
+    path = "ducky" + get_encoding(encoding).extension
+    save(ducky.image, path, encoding)
+    print(f"Ducky saved to {path}!")
@@ -2,14 +2,27 @@ import random
 import sys
 from collections import namedtuple
 from colorsys import hls_to_rgb
+from functools import lru_cache
+from itertools import groupby
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
-from PIL import Image, ImageChops
-from procedural_duckies import ProceduralDucky, make_ducky
+from PIL import Image
+
+from aaaaAAAA import instrumentation
+from aaaaAAAA.asset_pack import open_image
+from aaaaAAAA.ducky_recipes import DuckyRecipe
+from aaaaAAAA.encoding import get_encoding, save
+from aaaaAAAA.procedural_duckies import (
+    ProceduralDucky, ProceduralDuckyGenerator, Seed, Tint, TrimmedLayer, assets, downscale_layer,
+    fit_image, get_rng, level_size, make_ducky, make_overlay, mip_level, overlay_cache,
+    preload as preload_duckies, tint_layer, trim_layer
+)
+from aaaaAAAA.render_cache import RenderCache
 
 ManDucky = namedtuple("ManDucky", "image hat equipment outfit")
 DressColors = namedtuple("DressColors", "shirt pants")
+DuckyPair = namedtuple("DuckyPair", "ducky manducky")
 Color = tuple[int, int, int]
 
 DUCKY_SIZE = (600, 1194)
@@ -19,52 +32,143 @@ HAT_CHANCE = .7
 EQUIPMENT_CHANCE = .4
 OUTFIT_CHANCE = .5
 
+# Directories of the manduck templates, relative to the duck builder assets
+TEMPLATE_DIRECTORIES = (
+    "manduck",
+    "manduck/hats",
+    *(
+        f"manduck/variation {variation}{subdirectory}"
+        for variation in (1, 2) for subdirectory in ("", "/outfits", "/equipment")
+    ),
+)
+
+
+def make_manducky(
+    ducky: Union[ProceduralDucky, DuckyRecipe],
+    seed: Seed = None,
+    cache: Optional[RenderCache] = None,
+    size: Optional[int] = None,
+) -> ManDucky:
+    """
+    Generate a fully random ducky and returns a ProceduralDucky object.
+
+    Only the colors and accessories of the ducky are used, so it can also be given as a recipe,
+    without rendering it first.
+
+    The seed, cache and size work like the ones of make_ducky, the cache key also covers the given ducky.
+    """
+    cacheable = cache is not None and isinstance(seed, (int, str))
+    if cacheable:
+        key = ["manducky", seed, ducky.colors, ducky.hat, ducky.equipment, ducky.outfit, size]
+        cached = cache.get(key)
+        if cached:
+            metadata, image = cached
+            return ManDucky(image, metadata["hat"], metadata["equipment"], metadata["outfit"])
+
+    manducky = ManDuckGenerator(ducky, get_rng(seed), size=size).generate()
+
+    if cacheable:
+        cache.put(key, manducky.image, {
+            "hat": manducky.hat, "equipment": manducky.equipment, "outfit": manducky.outfit
+        })
+    return manducky
+
+
+def make_ducky_pair(seed: Seed = None, size: Optional[int] = None) -> DuckyPair:
+    """
+    Generate a ducky along with its human form in a single pass.
+
+    Both generators draw from the same random generator and share their recoloring tints, so every color
+    of the ducky is only turned into a tint once. The result is the same as making the ducky with
+    make_ducky and then its manducky with make_manducky, passing them the same random.Random instance.
+    Both images are shrunk to fit in a square of the given size, if there is one.
+    """
+    rng = get_rng(seed)
+    tints = {}
+    ducky = ProceduralDuckyGenerator(rng=rng, tints=tints, size=size).generate()
+    manducky = ManDuckGenerator(ducky, rng, tints, size).generate()
+    return DuckyPair(ducky, manducky)
 
-def make_manducky(ducky: ProceduralDucky) -> ManDucky:
-    """Generate a fully random ducky and returns a ProceduralDucky object."""
-    return ManDuckGenerator(ducky).generate()
+
+def make_ducky_pairs(n: int, seed: Seed = None, size: Optional[int] = None) -> list[DuckyPair]:
+    """Generate n duckies along with their human forms, all drawn from a single random generator."""
+    rng = get_rng(seed)
+    return [make_ducky_pair(rng, size) for _ in range(n)]
 
 
 def _load_image_assets(file_path: str) -> list[tuple[str, Image]]:
     return [
-        (filename.stem, Image.open(filename))
+        (filename.stem, open_image(filename))
         for filename in (ASSETS_PATH / file_path).iterdir()
         if not filename.is_dir()
     ]
 
 
+@lru_cache(maxsize=None)
+def _load_layer(path: Path, level: int = 0) -> TrimmedLayer:
+    """
+    Load a manduck template from the shared asset registry at the given mip level.
+
+    It is trimmed to the box where it isn't transparent.
+    """
+    return trim_layer(downscale_layer(assets.image(path), level))
+
+
+def preload() -> None:
+    """Decode and trim every manduck template, along with the ducky assets, rather than on first use."""
+    preload_duckies()
+    for directory in TEMPLATE_DIRECTORIES:
+        for path in assets.listing(directory):
+            _load_layer(path)
+
+
 class ManDuckGenerator:
-    """Temporary class used to generate a duckyhuman."""
+    """
+    Temporary class used to generate a duckyhuman.
+
+    Only the paths of the templates are worked out here, the templates themselves are shared by every
+    generator of the process and loaded the first time a manducky needs them.
+    """
 
-    def __init__(self, ducky: ProceduralDucky) -> None:
-        self.output: Image.Image = Image.new("RGBA", DUCKY_SIZE, color=(0, 0, 0, 0))
+    def __init__(
+        self,
+        ducky: Union[ProceduralDucky, DuckyRecipe],
+        rng: Optional[random.Random] = None,
+        tints: Optional[dict[Color, Tint]] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        self.rng = rng or random.Random()
+        # Like for duckies, the manducky is composited at the smallest mip level fitting the requested size
+        self.size = size
+        self.level = mip_level(DUCKY_SIZE, size)
+        self.output: Image.Image = Image.new("RGBA", level_size(DUCKY_SIZE, self.level), color=(0, 0, 0, 0))
         self.colors = ducky.colors
+        # Recoloring tints by color, shared with the ducky generator when rendering both at once
+        self.tints = {} if tints is None else tints
 
-        self.variation = random.choice((1, 2))
+        self.variation = self.rng.choice((1, 2))
 
-        self.templates = {
-            "head": Image.open(ASSETS_PATH / "manduck/manduck_head.png"),
-            "eye": Image.open(ASSETS_PATH / "manduck/manduck_eye.png"),
-            "bill": Image.open(ASSETS_PATH / "manduck/manduck_bill.png"),
-            "hands": Image.open(ASSETS_PATH / f"manduck/variation {self.variation}/hands.png"),
+        manduck_path = ASSETS_PATH / "manduck"
+        variation_path = manduck_path / f"variation {self.variation}"
+        self.templates: dict[str, Path] = {
+            "head": manduck_path / "manduck_head.png",
+            "eye": manduck_path / "manduck_eye.png",
+            "bill": manduck_path / "manduck_bill.png",
+            "hands": variation_path / "hands.png",
         }
 
         if self.variation == 1:
-            self.templates["dress"] = Image.open(ASSETS_PATH / f"manduck/variation {self.variation}/dress.png")
+            self.templates["dress"] = variation_path / "dress.png"
         if self.variation == 2:
-            self.templates["shirt"] = Image.open(ASSETS_PATH / f"manduck/variation {self.variation}/shirt.png")
-            self.templates["pants"] = Image.open(ASSETS_PATH / f"manduck/variation {self.variation}/pants.png")
+            self.templates["shirt"] = variation_path / "shirt.png"
+            self.templates["pants"] = variation_path / "pants.png"
 
         if ducky.hat:
-            self.templates["hat"] = Image.open(ASSETS_PATH / f"manduck/hats/{ducky.hat}.png")
+            self.templates["hat"] = manduck_path / f"hats/{ducky.hat}.png"
         if ducky.outfit:
-            self.templates["outfit"] = Image.open(
-                ASSETS_PATH / f"manduck/variation {self.variation}/outfits/{ducky.outfit}.png"
-            )
+            self.templates["outfit"] = variation_path / f"outfits/{ducky.outfit}.png"
         if ducky.equipment:
-            self.templates["equipment"] = Image.open(
-                ASSETS_PATH / f"manduck/variation {self.variation}/equipment/{ducky.equipment}.png"
-            )
+            self.templates["equipment"] = variation_path / f"equipment/{ducky.equipment}.png"
 
         self.hat = ducky.hat
         self.equipment = ducky.equipment
@@ -72,40 +176,68 @@ class ManDuckGenerator:
 
     def generate(self) -> ManDucky:
         """Actually generate the ducky."""
-        dress_colors = self.make_colors()
+        templates = {name: _load_layer(path, self.level) for name, path in self.templates.items()}
+        with instrumentation.timed("colors", "manducky dress"):
+            dress_colors = self.make_colors(self.rng)
 
+        # The template names of the layers, from the bottom one to the top one, along with their recolors
+        layers = []
         if self.variation == 2:
-            self.apply_layer(self.templates["pants"], dress_colors.pants)
-        self.apply_layer(self.templates["bill"], self.colors.beak)
-        self.apply_layer(self.templates["head"], self.colors.body)
-        self.apply_layer(self.templates["eye"], self.colors.eye_main)
+            layers.append(("pants", dress_colors.pants))
+        layers += [("bill", self.colors.beak), ("head", self.colors.body), ("eye", self.colors.eye_main)]
         if self.variation == 2:
-            self.apply_layer(self.templates["shirt"], dress_colors.shirt)
+            layers.append(("shirt", dress_colors.shirt))
         elif self.variation == 1:
-            self.apply_layer(self.templates["dress"], dress_colors.shirt)
+            layers.append(("dress", dress_colors.shirt))
         if self.outfit and self.outfit != "bread":
-            self.apply_layer(self.templates["outfit"])
+            layers.append(("outfit", None))
         if self.equipment:
-            self.apply_layer(self.templates["equipment"])
-        self.apply_layer(self.templates["hands"], self.colors.wing)
+            layers.append(("equipment", None))
+        layers.append(("hands", self.colors.wing))
         if self.outfit and self.outfit == "beard":
-            self.apply_layer(self.templates["outfit"])
+            layers.append(("outfit", None))
         if self.hat:
-            self.apply_layer(self.templates["hat"])
+            layers.append(("hat", None))
+
+        accessories = {"hat": self.hat, "equipment": self.equipment, "outfit": self.outfit}
+        # Accessories drawn right on top of each other, like an outfit and an equipment, are applied at once
+        for recolored, group in groupby(layers, key=lambda layer: layer[1] is not None):
+            group = list(group)
+            if recolored or len(group) == 1:
+                for name, recolor in group:
+                    with instrumentation.timed("layer", f"{name} {accessories[name]}" if name in accessories else name):
+                        self.apply_layer(templates[name], recolor)
+            else:
+                names = [name for name, _ in group]
+                with instrumentation.timed("layer", "overlay " + ", ".join(f"{n} {accessories[n]}" for n in names)):
+                    self.apply_overlay([self.templates[name] for name in names])
 
-        return ManDucky(self.output, self.hat, self.equipment, self.outfit)
+        return ManDucky(fit_image(self.output, DUCKY_SIZE, self.size), self.hat, self.equipment, self.outfit)
 
-    def apply_layer(self, layer: Image.Image, recolor: Optional[Color] = None) -> None:
+    def apply_layer(self, layer: TrimmedLayer, recolor: Optional[Color] = None) -> None:
         """Add the given layer on top of the ducky. Can be recolored with the recolor argument."""
+        image, offset = layer
         if recolor:
-            layer = ImageChops.multiply(layer, Image.new("RGBA", DUCKY_SIZE, color=recolor))
-        self.output.alpha_composite(layer)
+            image = tint_layer(image, recolor, self.tints)
+        # Only the region covered by the layer is composited
+        self.output.alpha_composite(image, offset)
+
+    def apply_overlay(self, paths: list[Path]) -> None:
+        """Add the templates at the given paths on top of the ducky in a single composite, through their overlay."""
+        key = ("manducky", tuple(paths), self.level)
+        overlay = overlay_cache.get(key)
+        if overlay is None:
+            overlay = make_overlay([_load_layer(path, self.level) for path in paths], self.output.size)
+            overlay_cache.put(key, overlay, sum(layer.width * layer.height * 4 for layer, _ in overlay))
+
+        for layer in overlay:
+            self.apply_layer(layer)
 
     @staticmethod
-    def make_color(hue: float, dark_variant: bool) -> tuple[float, float, float]:
+    def make_color(hue: float, dark_variant: bool, rng: random.Random = random) -> tuple[float, float, float]:
         """Make a nice hls color to use in a duck."""
         saturation = 1
-        lightness = random.uniform(.7, .85)
+        lightness = rng.uniform(.7, .85)
 
         # green and blue do not like high lightness, so we adjust this depending on how far from blue-green we are
         # hue_fix is the square of the distance between the hue and cyan (0.5 hue)
@@ -119,11 +251,11 @@ class ManDuckGenerator:
         return hue, lightness, saturation
 
     @classmethod
-    def make_colors(cls) -> DressColors:
+    def make_colors(cls, rng: random.Random = random) -> DressColors:
         """Create a matching DuckyColors object."""
-        hue = random.random()
-        dark_variant = random.choice([True, False])
-        shirt, pants = (cls.make_color(hue, dark_variant) for i in range(2))
+        hue = rng.random()
+        dark_variant = rng.choice([True, False])
+        shirt, pants = (cls.make_color(hue, dark_variant, rng) for i in range(2))
 
         scalar_colors = [hls_to_rgb(*color_pair) for color_pair in (shirt, pants)]
         colors = (tuple(int(color * 256) for color in color_pair) for color_pair in scalar_colors)
@@ -133,12 +265,14 @@ class ManDuckGenerator:
 
 # If this file is executed we generate a random ducky and save it to disk
 # A second argument can be given to seed the duck (that sounds a bit weird doesn't it)
+# and a third one to pick the encoding it's saved with, out of the ones of aaaaAAAA.encoding
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        random.seed(sys.argv[1])
+    rng = random.Random(sys.argv[1] if len(sys.argv) > 1 else None)
 
-    ducky = make_ducky()
-    ducky = make_manducky(ducky)
+    ducky = make_ducky(seed=rng)
+    ducky = make_manducky(ducky, seed=rng)
     print(*("{0}: {1}".format(key, value) for key, value in ducky._asdict().items()), sep="\n")
-    ducky.image.save("ducky.png")
-    print("Ducky saved to disk!")
+    encoding = sys.argv[2] if len(sys.argv) > 2 else "png"
+    path = "ducky" + get_encoding(encoding).extension
+    save(ducky.image, path, encoding)
+    print(f"Ducky saved to {path}!")
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from aaaaAAAA.asset_pack import ASSETS_PATH, asset_version
+
+# Bump this whenever a change to the generators changes what they render for a given seed
+RENDER_VERSION = 3
+
+
+class RenderCache:
+    """
+    On-disk cache of rendered images, keyed by what was rendered along with the version of the assets.
+
+    Every entry is a single file holding a line of JSON metadata followed by the raw RGBA pixels,
+    so a hit costs one file read and no decoding.
+    """
+
+    def __init__(self, path: Path, assets_path: Path = ASSETS_PATH):
+        self.path = path
+        self.assets_path = assets_path
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def file(self, key: list) -> Path:
+        """Return the path of the file storing the given key, which has to be JSON serializable."""
+        identity = json.dumps([RENDER_VERSION, asset_version(self.assets_path), key])
+        return self.path / f"{hashlib.sha256(identity.encode()).hexdigest()}.duck"
+
+    def get(self, key: list) -> Optional[tuple[dict, Image.Image]]:
+        """Return the metadata and the image stored for the key, or None if there isn't any."""
+        try:
+            data = self.file(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+        header, _, pixels = data.partition(b"\n")
+        metadata = json.loads(header)
+        return metadata, Image.frombytes("RGBA", metadata.pop("size"), pixels)
+
+    def put(self, key: list, image: Image.Image, metadata: dict) -> None:
+        """Store the image and its metadata for the key."""
+        header = json.dumps({**metadata, "size": image.size}).encode()
+
+        # Write to a temporary file first, so concurrent readers never see a partial entry
+        fd, temporary = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(header + b"\n")
+                file.write(image.convert("RGBA").tobytes())
+            os.replace(temporary, self.file(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import random
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from aaaaAAAA.ducky_recipes import make_recipe
+from aaaaAAAA.encoding import ENCODINGS, encode
+from aaaaAAAA.memory_cache import LRUCache
+from aaaaAAAA.procedural_duckies import DUCKY_SIZE, make_ducky
+from aaaaAAAA.procedural_humes import DUCKY_SIZE as MANDUCKY_SIZE, make_manducky, preload
+from aaaaAAAA.shared_cache import SharedRenderCache
+
+RESPONSE_CACHE_SIZE = 128 * 1024 * 1024
+MAX_PENDING_RENDERS = 64
+# Longest request line or header line, and most headers we accept
+MAX_LINE_SIZE = 8 * 1024
+MAX_HEADERS = 100
+IDLE_TIMEOUT = 30
+
+MAX_SIZES = {"ducky": max(DUCKY_SIZE), "manducky": max(MANDUCKY_SIZE)}
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+RenderKey = tuple[str, str, Optional[int], str]
+
+# The render cache shared by the worker processes, if the server was given one
+_shared_cache: Optional[SharedRenderCache] = None
+
+
+def init_worker(shared_cache: Optional[SharedRenderCache] = None) -> None:
+    """Prepare a worker process, reading the assets from the shared cache if there is one."""
+    global _shared_cache
+
+    # Interrupting the server reaches its whole process group, the server shuts the workers down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _shared_cache = shared_cache
+    if shared_cache:
+        shared_cache.use_assets()
+    preload()
+
+
+def render_image(kind: str, seed: str, size: Optional[int], encoding: str = "png", engine: str = "numpy") -> bytes:
+    """
+    Render a ducky or a manducky shrunk to fit in a square of the given size, and encode it.
+
+    The manducky of a seed is the human form of the ducky of the same seed, only the recipe
+    of that ducky is needed, so it isn't rendered. Renders are shared between the worker processes
+    through the shared cache, if there is one, whatever encoding they were requested in.
+    """
+    key = [kind, seed, size]
+    cached = _shared_cache and _shared_cache.get(key)
+    if cached:
+        return encode(cached[1], encoding)
+
+    rng = random.Random(seed)
+    recipe = make_recipe(seed=rng)
+    if kind == "ducky":
+        image = make_ducky(engine, size=size, recipe=recipe).image
+    else:
+        image = make_manducky(recipe, seed=rng, size=size).image
+
+    if _shared_cache:
+        _shared_cache.put(key, image, {})
+    return encode(image, encoding)
+
+
+class HTTPError(Exception):
+    """An error to send back to the client with the given status."""
+
+    def __init__(self, status: int, message: str, headers: Optional[dict[str, str]] = None):
+        super().__init__(status, message, headers)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class RenderServer:
+    """
+    Local HTTP server rendering duckies and manduckies by seed.
+
+    Renders happen in a pool of worker processes. Concurrent requests for the same render share it,
+    encoded responses are kept in an LRU cache, and new renders are refused with a 503 once
+    max_pending of them are already waiting on the pool.
+
+    If shared_cache_size isn't 0, the workers share a single copy of the decoded assets and
+    a cache of that many bytes of rendered images, through shared memory.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        cache_size: int = RESPONSE_CACHE_SIZE,
+        max_pending: int = MAX_PENDING_RENDERS,
+        engine: str = "numpy",
+        shared_cache_size: int = 0,
+    ):
+        # The workers are started on demand, once the server is already listening. Forked workers would inherit
+        # the listening socket and the connections open at that time, which then never see their end of file.
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.shared_cache = SharedRenderCache(shared_cache_size, context=self.context) if shared_cache_size else None
+        self.executor = self._start_pool()
+        self.responses = LRUCache(cache_size)
+        self.max_pending = max_pending
+        self.engine = engine
+
+        self.in_flight: dict[RenderKey, asyncio.Future] = {}
+        self.coalesced = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        """Return a new pool of worker processes."""
+        return ProcessPoolExecutor(
+            self.workers, self.context, initializer=init_worker, initargs=(self.shared_cache,)
+        )
+
+    async def render(self, key: RenderKey) -> bytes:
+        """Return the encoded render, from the cache, from a render already in progress, or from a new one."""
+        cached = self.responses.get(key)
+        if cached is not None:
+            return cached
+
+        if key in self.in_flight:
+            self.coalesced += 1
+            future = self.in_flight[key]
+        elif len(self.in_flight) >= self.max_pending:
+            self.rejected += 1
+            raise HTTPError(503, "Too many renders in progress, try again later.", {"Retry-After": "1"})
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                future = loop.run_in_executor(self.executor, render_image, *key, self.engine)
+            except BrokenProcessPool:
+                # A worker died while the pool was idle
+                self._restart_pool(self.executor)
+                future = loop.run_in_executor(self.executor, render_image, *key, self.engine)
+            self.in_flight[key] = future
+            future.add_done_callback(functools.partial(self._rendered, key, self.executor))
+
+        # Shielded so a client going away doesn't cancel the render for everyone else waiting on it
+        return await asyncio.shield(future)
+
+    def _rendered(self, key: RenderKey, executor: ProcessPoolExecutor, future: asyncio.Future) -> None:
+        """Cache a finished render and forget about it being in progress, restarting the pool if a worker died."""
+        del self.in_flight[key]
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            data = future.result()
+            self.responses.put(key, data, len(data))
+        elif isinstance(future.exception(), BrokenProcessPool):
+            self._restart_pool(executor)
+
+    def _restart_pool(self, executor: ProcessPoolExecutor) -> None:
+        """Replace the pool after one of its workers died, unless it was replaced already."""
+        if executor is not self.executor:
+            return
+        self.restarts += 1
+        executor.shutdown(wait=False)
+        # The pool terminates all of its workers once one dies, none of them can unpin its renders anymore
+        if self.shared_cache:
+            self.shared_cache.clear_pins()
+        self.executor = self._start_pool()
+
+    def stats(self) -> dict:
+        """Return statistics about the server."""
+        return {
+            "responses": self.responses.info()._asdict(),
+            "in_flight": len(self.in_flight),
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "shared_renders": self.shared_cache and self.shared_cache.info()._asdict(),
+        }
+
+    async def respond(self, method: str, target: str) -> tuple[int, dict[str, str], bytes]:
+        """Return the status, headers and body answering a request."""
+        if method != "GET":
+            raise HTTPError(405, "Only GET requests are supported.", {"Allow": "GET"})
+
+        try:
+            url = urlsplit(target)
+        except ValueError:
+            raise HTTPError(400, "Malformed request target.")
+        if url.path == "/stats":
+            return 200, {"Content-Type": "application/json"}, json.dumps(self.stats()).encode()
+
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] not in MAX_SIZES or not parts[1]:
+            raise HTTPError(404, "Expected /ducky/<seed> or /manducky/<seed>.")
+        kind, seed = parts[0], unquote(parts[1])
+
+        query = parse_qs(url.query)
+        size = query.get("size", [None])[-1]
+        if size is not None:
+            if not size.isdigit() or not 0 < int(size) <= MAX_SIZES[kind]:
+                raise HTTPError(400, f"The size has to be a number between 1 and {MAX_SIZES[kind]}.")
+            size = int(size)
+
+        encoding = query.get("format", ["png"])[-1]
+        if encoding not in ENCODINGS:
+            raise HTTPError(400, f"The format has to be one of {', '.join(ENCODINGS)}.")
+
+        body = await self.render((kind, seed, size, encoding))
+        return 200, {"Content-Type": ENCODINGS[encoding].content_type}, body
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of a connection until it is closed."""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                    if not request_line:
+                        break
+                    headers = {}
+                    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                        if len(headers) > MAX_HEADERS:
+                            raise ValueError("Too many headers.")
+                except (asyncio.TimeoutError, ValueError):
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    status, response_headers, body, version = 400, {}, b"Malformed request line.\n", "HTTP/1.0"
+                else:
+                    # A ValueError raised while rendering or encoding is a failure of the server, not of the request
+                    try:
+                        status, response_headers, body = await self.respond(method, target)
+                    except HTTPError as error:
+                        status, response_headers, body = error.status, error.headers, f"{error.message}\n".encode()
+                    except Exception as error:
+                        status, response_headers, body = 500, {}, f"Rendering failed: {error!r}\n".encode()
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                response_headers.setdefault("Content-Type", "text/plain")
+                response_headers["Content-Length"] = str(len(body))
+                response_headers["Connection"] = "keep-alive" if keep_alive else "close"
+
+                head = f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                head += "".join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+                writer.write(head.encode("latin-1") + b"\r\n" + body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """Serve requests until cancelled."""
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_LINE_SIZE)
+        print(f"Serving duckies on http://{host}:{port}/ducky/<seed>", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            # Only once the workers are gone, so none of them is still using the shared memory
+            if self.shared_cache:
+                self.shared_cache.unlink()
+
+
+def main() -> None:
+    """Parse the command line arguments and run the server."""
+    parser = argparse.ArgumentParser(description="Serve procedural duckies over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--workers", type=int, help="number of render processes, one per CPU by default")
+    parser.add_argument("--cache-size", type=int, default=RESPONSE_CACHE_SIZE, help="bytes of responses to cache")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING_RENDERS, help="renders to queue at most")
+    parser.add_argument(
+        "--shared-cache-size", type=int, default=0, help="bytes of renders shared by the workers, 0 to disable"
+    )
+    args = parser.parse_args()
+
+    server = RenderServer(args.workers, args.cache_size, args.max_pending, shared_cache_size=args.shared_cache_size)
+    # Terminating the server shuts it down like interrupting it does, so the shared memory is freed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
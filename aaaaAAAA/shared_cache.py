@@ -0,0 +1,231 @@
+import atexit
+import hashlib
+import json
+import multiprocessing
+import weakref
+from multiprocessing.context import BaseContext
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from aaaaAAAA.asset_pack import ALIGNMENT, ASSETS_PATH, AssetPack, pack_assets, use_pack
+from aaaaAAAA.memory_cache import CacheInfo
+
+SHARED_CACHE_SIZE = 256 * 1024 * 1024
+SHARED_CACHE_SLOTS = 512
+
+# Every slot of the index describes a cached render, free slots have a sequence number of 0
+INDEX_ENTRY = np.dtype([
+    ("digest", "<u8", 2),
+    ("offset", "<u8"),
+    ("meta_size", "<u4"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("pins", "<i4"),
+    ("sequence", "<u8"),
+])
+# Position the next render is written at, last sequence number given out, hits and misses
+COUNTERS = 4
+
+
+class SharedRenderCache:
+    """
+    Render cache in shared memory, that every worker process of a pool reads from without copying.
+
+    A single block of shared memory holds the decoded duck builder assets, which the worker processes
+    use instead of decoding their own copy, followed by an index of the cached renders and a ring buffer
+    of their pixels. New renders are written after the last one and wrap around at the end of the buffer,
+    evicting the oldest renders in their way, or the oldest one when all the index slots are taken.
+
+    Cached images are returned on top of the shared memory. While such an image is alive its render
+    is pinned, and a put that would overwrite it is dropped instead.
+
+    It works like a RenderCache and is meant to be passed as the initargs of the pool, so every
+    worker attaches to the same block. The lock is made with the given multiprocessing context,
+    which has to be the one of the pool. With a size of 0, only the assets are shared.
+
+    The process that created the cache has to call unlink when done with it, the other ones only
+    close it. If it doesn't, the block is still freed when the interpreter exits. Renders pinned by
+    a worker that died stay pinned until clear_pins is called.
+    """
+
+    def __init__(
+        self,
+        size: int = SHARED_CACHE_SIZE,
+        slots: int = SHARED_CACHE_SLOTS,
+        share_assets: bool = True,
+        context: Optional[BaseContext] = None,
+    ):
+        assets = pack_assets(ASSETS_PATH)[0] if share_assets else bytearray()
+        self.assets_size = -(-len(assets) // ALIGNMENT) * ALIGNMENT
+        self.slots = slots
+        self.ring_size = size
+        self.lock = (context or multiprocessing).Lock()
+        self.owner = True
+        self.closed = False
+        self.unlinked = False
+
+        self.memory = SharedMemory(create=True, size=self._layout_size())
+        atexit.register(self.unlink)
+        try:
+            self.memory.buf[:len(assets)] = assets
+            self._attach()
+        except BaseException:
+            self.unlink()
+            raise
+        # A new block is filled with zeros, so every counter starts at 0 and every slot is free
+
+    def _layout_size(self) -> int:
+        """Return the size of the shared block: the assets, the counters, the index and the ring buffer."""
+        return self._ring_offset() + self.ring_size
+
+    def _ring_offset(self) -> int:
+        index_end = self.assets_size + COUNTERS * 8 + self.slots * INDEX_ENTRY.itemsize
+        return -(-index_end // ALIGNMENT) * ALIGNMENT
+
+    def _attach(self) -> None:
+        """Create the views on the shared block."""
+        buffer = self.memory.buf
+        self.counters = np.ndarray(COUNTERS, "<u8", buffer, self.assets_size)
+        self.index = np.ndarray(self.slots, INDEX_ENTRY, buffer, self.assets_size + COUNTERS * 8)
+        self.ring = buffer[self._ring_offset():self._ring_offset() + self.ring_size]
+        self.assets = AssetPack(root=ASSETS_PATH, buffer=buffer[:self.assets_size]) if self.assets_size else None
+
+    def __getstate__(self) -> dict:
+        # Only the name of the block is sent to the workers, which attach to it
+        return {
+            "name": self.memory.name, "assets_size": self.assets_size, "slots": self.slots,
+            "ring_size": self.ring_size, "lock": self.lock,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.assets_size = state["assets_size"]
+        self.slots = state["slots"]
+        self.ring_size = state["ring_size"]
+        self.lock = state["lock"]
+        self.owner = False
+        self.closed = False
+        self.memory = SharedMemory(state["name"])
+        self._attach()
+
+    def use_assets(self) -> None:
+        """Read the duck builder images from the shared block in this process, before anything is generated."""
+        if self.assets:
+            use_pack(self.assets)
+
+    @staticmethod
+    def digest(key: list) -> np.ndarray:
+        """Hash the key, which has to be JSON serializable."""
+        return np.frombuffer(hashlib.blake2b(json.dumps(key).encode(), digest_size=16).digest(), "<u8")
+
+    def get(self, key: list) -> Optional[tuple[dict, Image.Image]]:
+        """Return the metadata and a read-only image stored for the key, or None if there isn't any."""
+        digest = self.digest(key)
+        with self.lock:
+            found, = np.nonzero((self.index["sequence"] != 0) & (self.index["digest"] == digest).all(axis=1))
+            if not len(found):
+                self.counters[3] += 1
+                return None
+            self.counters[2] += 1
+            slot = int(found[0])
+            self.index["pins"][slot] += 1
+            offset, meta_size, width, height = (
+                int(self.index[field][slot]) for field in ("offset", "meta_size", "width", "height")
+            )
+
+        metadata = json.loads(bytes(self.ring[offset:offset + meta_size]))
+        start = offset + meta_size
+        pixels = self.ring[start:start + width * height * 4]
+        image = Image.frombuffer("RGBA", (width, height), pixels, "raw", "RGBA", 0, 1)
+        # The render can't be overwritten until the image is gone
+        weakref.finalize(image, self._unpin, slot)
+        return metadata, image
+
+    def _unpin(self, slot: int) -> None:
+        if self.closed:
+            return
+        with self.lock:
+            self.index["pins"][slot] -= 1
+
+    def clear_pins(self) -> None:
+        """Unpin every render, once all the worker processes that could be using them are gone."""
+        with self.lock:
+            self.index["pins"] = 0
+
+    def _entry_ends(self) -> np.ndarray:
+        """Return where the data of every slot of the index ends in the ring buffer."""
+        index = self.index
+        return index["offset"] + index["meta_size"] + index["width"].astype("<u8") * index["height"] * 4
+
+    def put(self, key: list, image: Image.Image, metadata: dict) -> None:
+        """Store the image and its metadata for the key, unless it would overwrite an image in use."""
+        digest = self.digest(key)
+        header = json.dumps(metadata).encode()
+        pixels = image.convert("RGBA").tobytes()
+        size = -(-(len(header) + len(pixels)) // ALIGNMENT) * ALIGNMENT
+        if size > self.ring_size:
+            return
+
+        with self.lock:
+            index = self.index
+            used = index["sequence"] != 0
+            if (used & (index["digest"] == digest).all(axis=1)).any():
+                return
+
+            start = int(self.counters[0])
+            if start + size > self.ring_size:
+                start = 0
+            overlapping = used & (index["offset"] < start + size) & (self._entry_ends() > start)
+            if not used.all():
+                slot = int(np.argmin(used))
+            else:
+                # Every slot is taken, so the oldest render is evicted as well
+                slot = int(np.argmin(index["sequence"]))
+                overlapping[slot] = True
+            if (index["pins"][overlapping] > 0).any():
+                return
+
+            index["sequence"][overlapping] = 0
+            self.ring[start:start + len(header)] = header
+            self.ring[start + len(header):start + len(header) + len(pixels)] = pixels
+            self.counters[1] += 1
+            index[slot] = (digest, start, len(header), image.width, image.height, 0, self.counters[1])
+            self.counters[0] = start + size
+
+    def info(self) -> CacheInfo:
+        """Return the hit and miss counts of every process together, and the memory used by the cached renders."""
+        with self.lock:
+            used = self.index["sequence"] != 0
+            nbytes = int((self._entry_ends() - self.index["offset"])[used].sum())
+            return CacheInfo(int(self.counters[2]), int(self.counters[3]), int(used.sum()), nbytes, self.ring_size)
+
+    def close(self) -> None:
+        """Detach from the shared block, images still using it keep it mapped until they are gone."""
+        if self.closed:
+            return
+        self.closed = True
+        for view in ("counters", "index", "ring", "assets"):
+            self.__dict__.pop(view, None)
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+
+    def unlink(self) -> None:
+        """Close the cache and free the shared block, in the process that created it."""
+        self.close()
+        if self.owner and not self.unlinked:
+            self.unlinked = True
+            atexit.unregister(self.unlink)
+            self.memory.unlink()
+
+    def __enter__(self) -> "SharedRenderCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
@@ -1,15 +1,219 @@
 #! /bin/env python
+import argparse
+import random
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, Iterator, Optional
+
+import numpy as np
 from PIL import Image
 
-from aaaaAAAA.procedural_duckies import DUCKY_SIZE, make_ducky
+from aaaaAAAA.encoding import ENCODINGS, EncodingPool, get_encoding, save
+from aaaaAAAA.procedural_duckies import DUCKY_SIZE, GENERATOR_ENGINES, make_ducky
+from aaaaAAAA.shared_cache import SharedRenderCache
+
+Tile = tuple[int, int, int, str]
+
+
+def tile_seed(seed: int, x: int, y: int) -> str:
+    """Return the seed of a single tile, which only depends on the board seed and the tile position."""
+    return f"{seed}:{x}:{y}"
+
+
+def render_tile(tile: Tile) -> Image.Image:
+    """Render the ducky of a single tile."""
+    x, y, seed, engine = tile
+    return make_ducky(engine, seed=tile_seed(seed, x, y)).image
+
+
+def init_worker(shared_assets: Optional[SharedRenderCache]) -> None:
+    """Read the duck builder images from the shared block in this worker if there is one."""
+    if shared_assets is not None:
+        shared_assets.use_assets()
+
+
+def render_rows(
+    nx: int, ny: int, seed: int, workers: int = 1, engine: str = "pillow", lookahead: int = 2,
+    share_assets: bool = False
+) -> Iterator[list[Image.Image]]:
+    """
+    Render the duckies of a board row by row, spreading them over a pool of worker processes.
+
+    Every tile is seeded on its own, so the board is the same whatever the amount of workers.
+    At most lookahead rows are rendered ahead of the one being consumed, to keep the memory use bounded.
+
+    With share_assets, every asset is decoded once up front into shared memory for all the workers to
+    read, instead of each worker decoding the ones it comes across. That takes a couple of seconds
+    and a few hundred megabytes, so it only pays off for boards big enough to need every asset anyway.
+    """
+    rows = ([(x, y, seed, engine) for x in range(nx)] for y in range(ny))
+    if workers <= 1:
+        for row in rows:
+            yield list(map(render_tile, row))
+        return
+
+    # The pool is shut down first, so no worker is still reading the shared assets when they are freed
+    with SharedRenderCache(size=0, slots=0) if share_assets else nullcontext() as shared_assets:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(shared_assets,)) as executor:
+            pending = deque()
+            for row in rows:
+                pending.append([executor.submit(render_tile, tile) for tile in row])
+                if len(pending) > lookahead:
+                    yield [future.result() for future in pending.popleft()]
+            while pending:
+                yield [future.result() for future in pending.popleft()]
+
+
+def render_strip(row: list[Image.Image]) -> Image.Image:
+    """Put a row of duckies side by side on a white strip."""
+    width, height = DUCKY_SIZE
+    strip = Image.new("RGBA", (len(row) * width, height), color=(255, 255, 255, 255))
+    for x, ducky in enumerate(row):
+        strip.alpha_composite(ducky, (x * width, 0))
+    return strip
+
+
+def render_board(
+    nx: int, ny: int, seed: int, workers: int = 1, engine: str = "pillow", share_assets: bool = False
+) -> Image.Image:
+    """Render a whole board of nx by ny duckies."""
+    width, height = DUCKY_SIZE
+    res = Image.new("RGBA", (nx * width, ny * height), color=(255, 255, 255, 255))
+
+    for y, row in enumerate(render_rows(nx, ny, seed, workers, engine, share_assets=share_assets)):
+        res.paste(render_strip(row), (0, y * height))
+
+    return res
+
+
+class PngStripWriter:
+    """
+    Write an RGBA PNG a horizontal strip at a time, so the whole image never has to be in memory.
+
+    Pillow can only save complete images, so this writes the PNG chunks itself.
+    Every scanline uses the Sub filter, which suits the flat colors of the duckies well.
+    """
+
+    def __init__(self, file: BinaryIO, width: int, height: int, compression: int = 6):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compression)
+
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits per channel, RGBA, default compression and filtering, not interlaced
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def write_chunk(self, kind: bytes, data: bytes) -> None:
+        """Write a single PNG chunk."""
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write_strip(self, strip: Image.Image) -> None:
+        """Append the rows of the strip to the image."""
+        self.write_encoded(self.encode_strip(strip))
+
+    def encode_strip(self, strip: Image.Image) -> bytes:
+        """
+        Filter and compress the rows of the strip, returning the compressed data to write.
+
+        Strips have to be encoded one at a time and in order, since they share the compressor.
+        """
+        if strip.mode != "RGBA" or strip.width != self.width:
+            raise ValueError(f"Expected an RGBA strip {self.width} pixels wide, got {strip.mode} {strip.width}.")
+        if self.rows_written + strip.height > self.height:
+            raise ValueError("The strip doesn't fit in the remaining rows of the image.")
+
+        pixels = np.asarray(strip)
+        scanlines = np.empty((strip.height, 1 + self.width * 4), dtype=np.uint8)
+        scanlines[:, 0] = 1
+        scanlines[:, 1:5] = pixels[:, 0]
+        # The Sub filter stores every byte as the difference with the same channel of the pixel to its left
+        np.subtract(pixels[:, 1:], pixels[:, :-1], out=scanlines[:, 5:].reshape(strip.height, -1, 4))
+
+        data = self.compressor.compress(scanlines.tobytes())
+        self.rows_written += strip.height
+        return data
+
+    def write_encoded(self, data: bytes) -> None:
+        """Write the compressed data of a strip returned by encode_strip."""
+        if data:
+            self.write_chunk(b"IDAT", data)
+
+    def close(self) -> None:
+        """Flush the compressed data and finish the image."""
+        if self.rows_written != self.height:
+            raise ValueError(f"Only {self.rows_written} of the {self.height} rows were written.")
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+
+
+def stream_board(
+    path: str, nx: int, ny: int, seed: int, workers: int = 1, engine: str = "pillow", compression: int = 6,
+    share_assets: bool = False
+) -> None:
+    """
+    Render a board of nx by ny duckies to a PNG file, one row at a time.
+
+    A row is compressed on a background thread while the next one is rendered and composited.
+    """
+    width, height = DUCKY_SIZE
+    start = time.perf_counter()
+
+    with open(path, "wb") as file:
+        writer = PngStripWriter(file, nx * width, ny * height, compression)
+        rows = render_rows(nx, ny, seed, workers, engine, share_assets=share_assets)
+        # A single thread, since the strips share the compressor of the image
+        with EncodingPool(1, encoder=writer.encode_strip) as pool:
+            encoded = pool.encode_all((render_strip(row) for row in rows), lookahead=1)
+            for y, data in enumerate(encoded):
+                writer.write_encoded(data)
+
+                elapsed = time.perf_counter() - start
+                print(f"Row {y + 1}/{ny} written, {(y + 1) * nx / elapsed:.1f} duckies/s", flush=True)
+        writer.close()
+
+
+def main() -> None:
+    """Parse the command line arguments and render the board."""
+    parser = argparse.ArgumentParser(description="Render a board of procedural duckies.")
+    parser.add_argument("--width", type=int, default=8, help="number of duckies in a row")
+    parser.add_argument("--height", type=int, default=5, help="number of duckies in a column")
+    parser.add_argument("--seed", type=int, help="seed of the board, picked at random if not given")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to render with")
+    parser.add_argument(
+        "--share-assets", action="store_true", help="decode the assets once for all the workers, for big boards"
+    )
+    parser.add_argument("--engine", choices=GENERATOR_ENGINES, default="pillow", help="compositing engine")
+    parser.add_argument("--output", default="ducky_board.png", help="path to save the board to")
+    parser.add_argument(
+        "--encoding", choices=ENCODINGS, help="how to encode the board, picked from the output extension by default"
+    )
+    parser.add_argument(
+        "--stream", action="store_true", help="write the board a row at a time instead of keeping it in memory"
+    )
+    args = parser.parse_args()
+    if args.stream and args.encoding and get_encoding(args.encoding).format != "PNG":
+        parser.error("only PNG encodings can be streamed")
 
-width, height = DUCKY_SIZE
-nx, ny = 8, 5
+    seed = random.randrange(2**32) if args.seed is None else args.seed
+    print(f"Rendering a {args.width}x{args.height} board with seed {seed}")
 
-res = Image.new("RGBA", (nx * width, ny * height), color=(255, 255, 255, 255))
+    if args.stream:
+        compression = get_encoding(args.encoding or "png").options["compress_level"]
+        stream_board(
+            args.output, args.width, args.height, seed, args.workers, args.engine, compression, args.share_assets
+        )
+    else:
+        res = render_board(args.width, args.height, seed, args.workers, args.engine, args.share_assets)
+        save(res, args.output, args.encoding)
 
-for x in range(nx):
-    for y in range(ny):
-        res.alpha_composite(make_ducky().image, (x * width, y * height))
 
-res.save('ducky_board.png')
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#! /bin/env python
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from itertools import count
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Union
+
+import PIL
+import numpy as np
+from continuous_duckies import render_board
+
+from aaaaAAAA.numpy_duckies import NumpyDuckyGenerator
+from aaaaAAAA.procedural_duckies import ProceduralDuckyGenerator, layer_cache, make_ducky, preload as preload_duckies
+from aaaaAAAA.procedural_humes import ManDuckGenerator, _load_layer, make_ducky_pair, make_manducky, preload
+
+# Bump this whenever the cases change in a way that makes older results incomparable
+SUITE_VERSION = 1
+DEFAULT_THRESHOLD = .15
+
+# A case runs the measured code once per call, its factory gets the seeds to use and the command line arguments,
+# and returns None if the case can't run here
+Case = Callable[[], None]
+CaseFactory = Callable[[Iterator[int], argparse.Namespace], Optional[Case]]
+
+CASES: dict[str, CaseFactory] = {}
+
+
+def case(name: str) -> Callable[[CaseFactory], CaseFactory]:
+    """Register a benchmark case under the given name."""
+    def register(factory: CaseFactory) -> CaseFactory:
+        CASES[name] = factory
+        return factory
+    return register
+
+
+@case("make_ducky")
+def bench_make_ducky(seeds: Iterator[int], args: argparse.Namespace) -> Case:
+    """Generate a whole ducky with the Pillow engine."""
+    return lambda: make_ducky(seed=next(seeds))
+
+
+@case("make_ducky.numpy")
+def bench_make_ducky_numpy(seeds: Iterator[int], args: argparse.Namespace) -> Case:
+    """Generate a whole ducky with the numpy engine."""
+    return lambda: make_ducky("numpy", seed=next(seeds))
+
+
+@case("make_manducky")
+def bench_make_manducky(seeds: Iterator[int], args: argparse.Namespace) -> Case:
+    """Generate the human form of a ducky, the ducky itself being rendered beforehand."""
+    duckies = [make_ducky(seed=seed) for seed in range(16)]
+
+    def run() -> None:
+        seed = next(seeds)
+        make_manducky(duckies[seed % len(duckies)], seed=seed)
+    return run
+
+
+@case("make_ducky_pair")
+def bench_make_ducky_pair(seeds: Iterator[int], args: argparse.Namespace) -> Case:
+    """Generate a ducky along with its human form."""
+    return lambda: make_ducky_pair(next(seeds))
+
+
+@case("make_colors")
+def bench_make_colors(seeds: Iterator[int], args: argparse.Namespace) -> Case:
+    """Generate the colors of a ducky."""
+    rng = random.Random(next(seeds))
+    return lambda: ProceduralDuckyGenerator.make_colors(rng=rng)
+
+
+def apply_layer_case(generator: Union[ProceduralDuckyGenerator, ManDuckGenerator], layer: object) -> Case:
+    """Apply a layer recolored with the body color, without the help of the layer cache, over and over."""
+    def run() -> None:
+        layer_cache.clear()
+        generator.apply_layer(layer, generator.colors.body)
+    return run
+
+
+# Every template of the ducky and the manducky
+for number in range(1, 6):
+    for suffix, generator in (("", ProceduralDuckyGenerator), (".numpy", NumpyDuckyGenerator)):
+        case(f"apply_layer.ducky{suffix}.template_{number}")(
+            lambda seeds, args, generator=generator, number=number: apply_layer_case(
+                generator(rng=random.Random(next(seeds))), generator.templates[number]
+            )
+        )
+
+for template in (
+    "manduck_head", "manduck_eye", "manduck_bill",
+    "variation 1/hands", "variation 1/dress", "variation 2/hands", "variation 2/shirt", "variation 2/pants",
+):
+    case(f"apply_layer.manducky.{template.replace('variation ', 'variation_').replace('/', '.')}")(
+        lambda seeds, args, template=template: apply_layer_case(
+            ManDuckGenerator(make_ducky(seed=next(seeds)), random.Random(next(seeds))),
+            _load_layer(Path(f"assets/duck-builder/manduck/{template}.png")),
+        )
+    )
+
+
+@case("continuous_duckies.board")
+def bench_board(seeds: Iterator[int], args: argparse.Namespace) -> Case:
+    """Render a whole continuous duckies board, of the size given on the command line."""
+    width, height = args.board
+    return lambda: render_board(width, height, next(seeds), args.workers)
+
+
+@case("sprites.Ducky")
+def bench_sprite(seeds: Iterator[int], args: argparse.Namespace) -> Optional[Case]:
+    """Construct the ducky sprite of the game, without opening a window."""
+    # Has to be set before arcade gets imported
+    os.environ.setdefault("ARCADE_HEADLESS", "1")
+    try:
+        from aaaaAAAA import _sprites
+    except ImportError:
+        return None
+
+    return lambda: _sprites.Ducky(0.07, seed=next(seeds)).remove_from_sprite_lists()
+
+
+def measure(run: Case, repeat: int, number: int) -> dict[str, float]:
+    """Time number calls of the case, repeat times, and summarize the time taken by a single call."""
+    run()  # Warm up, so decoding the assets isn't measured
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        timings.append((time.perf_counter() - start) / number)
+    return {"median": statistics.median(timings), "min": min(timings), "max": max(timings)}
+
+
+def run_suite(args: argparse.Namespace) -> dict:
+    """Run the selected cases and return the results along with a description of the environment."""
+    preload()
+    preload_duckies()
+
+    results = {}
+    for name, factory in CASES.items():
+        if args.cases and not any(name.startswith(prefix) for prefix in args.cases):
+            continue
+        # Every case gets the same sequence of seeds, however many cases run before it
+        seeds = count(args.seed)
+        run = factory(seeds, args)
+        if run is None:
+            print(f"{name:<45} skipped, its dependencies aren't installed")
+            continue
+
+        number = 1 if name.startswith("continuous_duckies") else args.number
+        results[name] = measure(run, args.repeat, number)
+        print(f"{name:<45} {results[name]['median'] * 1000:>10.3f}ms")
+
+    return {
+        "suite_version": SUITE_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "options": {"seed": args.seed, "repeat": args.repeat, "number": args.number, "board": args.board},
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Print how every case changed since the baseline, and return the ones slower by more than the threshold."""
+    if baseline.get("suite_version") != current.get("suite_version"):
+        raise ValueError("The baseline was made with another version of the suite, make a new one.")
+
+    regressions = []
+    print(f"{'case':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<45} {'-':>12} {result['median'] * 1000:>10.3f}ms {'new':>8}")
+            continue
+        before, after = baseline["results"][name]["median"], result["median"]
+        change = after / before - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<45} {before * 1000:>10.3f}ms {after * 1000:>10.3f}ms {change:>+7.1%}"
+            + (" REGRESSED" if regressed else "")
+        )
+    return regressions
+
+
+def board_size(value: str) -> tuple[int, int]:
+    """Parse a board size given as WIDTHxHEIGHT."""
+    try:
+        width, height = map(int, value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a size like 4x3, got {value!r}") from None
+    return width, height
+
+
+def main() -> None:
+    """Parse the command line arguments, then run the suite or compare results."""
+    parser = argparse.ArgumentParser(description="Benchmark the ducky generation and game hot paths.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("cases", nargs="*", help="only run the cases starting with one of these names")
+    run_parser.add_argument("--output", type=Path, help="path to write the JSON results to")
+    run_parser.add_argument("--baseline", type=Path, help="results to compare with, failing on regressions")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="tolerated slowdown")
+    run_parser.add_argument("--seed", type=int, default=0, help="first seed of every case")
+    run_parser.add_argument("--repeat", type=int, default=5, help="number of timed rounds per case")
+    run_parser.add_argument("--number", type=int, default=20, help="number of calls per round")
+    run_parser.add_argument("--board", type=board_size, default=(4, 3), help="size of the benchmarked board")
+    run_parser.add_argument("--workers", type=int, default=1, help="number of processes rendering the board")
+
+    compare_parser = subparsers.add_parser("compare", help="compare results with a baseline")
+    compare_parser.add_argument("baseline", type=Path, help="results of the baseline run")
+    compare_parser.add_argument("current", type=Path, help="results of the run to check")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="tolerated slowdown")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = run_suite(args)
+        if args.output:
+            args.output.write_text(json.dumps(current, indent=2))
+        baseline = args.baseline and json.loads(args.baseline.read_text())
+    else:
+        baseline = json.loads(args.baseline.read_text())
+        current = json.loads(args.current.read_text())
+
+    if baseline:
+        print()
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#! /bin/env python
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+async def fetch(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str) -> int:
+    """Send a GET request over a kept-alive connection and return the status of the response."""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    return status
+
+
+async def client(url: str, paths: list[str], latencies: list[float], statuses: Counter) -> None:
+    """Request the paths one after the other, recording the latency and status of every response."""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            status = await fetch(reader, writer, parts.netloc, path)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+
+async def load_test(
+    url: str, requests: int, concurrency: int, seeds: int, kind: str, size: int, seed: int
+) -> tuple[list[float], Counter, float]:
+    """Fire the requests from concurrent clients, returning the latencies, statuses and total duration."""
+    rng = random.Random(seed)
+    paths = [f"/{kind}/{rng.randrange(seeds)}?size={size}" for _ in range(requests)]
+    latencies = []
+    statuses = Counter()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(url, paths[i::concurrency], latencies, statuses) for i in range(concurrency)
+    ))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main() -> None:
+    """Parse the command line arguments, run the load test and report the results."""
+    parser = argparse.ArgumentParser(description="Load test a running ducky render server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="address of the render server")
+    parser.add_argument("--requests", type=int, default=500, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent connections")
+    parser.add_argument("--seeds", type=int, default=100, help="number of distinct seeds to request")
+    parser.add_argument("--kind", choices=("ducky", "manducky"), default="ducky", help="what to render")
+    parser.add_argument("--size", type=int, default=128, help="size of the requested renders")
+    parser.add_argument("--seed", type=int, default=0, help="seed used to pick the requested seeds")
+    args = parser.parse_args()
+
+    latencies, statuses, duration = asyncio.run(load_test(
+        args.url, args.requests, args.concurrency, args.seeds, args.kind, args.size, args.seed
+    ))
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(f"{len(latencies)} requests in {duration:.2f}s, {len(latencies) / duration:.1f} requests/s")
+    print("Statuses:", ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+    p50, p90, p99 = (percentiles[i] * 1000 for i in (49, 89, 98))
+    print(f"Latency p50: {p50:.1f}ms, p90: {p90:.1f}ms, p99: {p99:.1f}ms, max: {max(latencies) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
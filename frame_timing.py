@@ -0,0 +1,63 @@
+#! /bin/env python
+import argparse
+import statistics
+import time
+from typing import Callable
+
+from aaaaAAAA.ducky_pool import DuckyPool, SpriteDucky, render_sprite_ducky
+from aaaaAAAA.procedural_duckies import preload
+
+FRAME_BUDGET = 1 / 60
+
+
+def run_frames(spawn: Callable[[], SpriteDucky], frames: int, spawn_every: int) -> list[float]:
+    """
+    Run a headless 60 FPS frame loop spawning a ducky every spawn_every frames, and return the frame times.
+
+    Spawning takes a ducky and reads its pixels like uploading its texture would, the rest of
+    the frame is spent sleeping, which is when the background threads get to render.
+    """
+    timings = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        if frame % spawn_every == 0:
+            _, image = spawn()
+            image.tobytes()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        time.sleep(max(FRAME_BUDGET - elapsed, 0))
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    """Print the distribution of the frame times and how many went over the budget."""
+    ordered = sorted(timings)
+    slow = sum(timing > FRAME_BUDGET for timing in timings)
+    print(
+        f"{name:<10} median {statistics.median(ordered) * 1000:6.2f}ms"
+        f"  p99 {ordered[int(len(ordered) * .99)] * 1000:6.2f}ms  max {ordered[-1] * 1000:6.2f}ms"
+        f"  over budget {slow}/{len(timings)}"
+    )
+
+
+def main() -> None:
+    """Parse the command line arguments and compare spawning duckies synchronously and from the pool."""
+    parser = argparse.ArgumentParser(description="Measure the frame times of spawning duckies, headless.")
+    parser.add_argument("--frames", type=int, default=600, help="number of frames to run")
+    parser.add_argument("--spawn-every", type=int, default=10, help="frames between two spawns")
+    parser.add_argument("--ready", type=int, default=8, help="number of duckies the pool keeps ready")
+    parser.add_argument("--workers", type=int, default=1, help="number of threads rendering for the pool")
+    args = parser.parse_args()
+
+    preload()
+    report("sync", run_frames(render_sprite_ducky, args.frames, args.spawn_every))
+
+    with DuckyPool(args.ready, args.workers) as pool:
+        pool.warm()
+        timings = run_frames(pool.take, args.frames, args.spawn_every)
+    report("pool", timings)
+    print(f"the pool was empty for {pool.misses} of {-(-args.frames // args.spawn_every)} spawns")
+
+
+if __name__ == "__main__":
+    main()
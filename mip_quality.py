@@ -0,0 +1,65 @@
+#! /bin/env python
+import argparse
+import random
+import time
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from aaaaAAAA.procedural_duckies import DUCKY_SIZE, fit_size, make_ducky, mip_level
+from aaaaAAAA.procedural_humes import DUCKY_SIZE as MANDUCKY_SIZE, make_manducky, preload
+
+SIZES = (300, 128, 64, 42, 16)
+
+
+def psnr(image: Image.Image, reference: Image.Image) -> float:
+    """Return the peak signal to noise ratio between two images of the same size, in decibels."""
+    # Comparing premultiplied colors, so differences in the color of transparent pixels don't count
+    pixels, expected = (np.asarray(im.convert("RGBa"), dtype=np.float64) for im in (image, reference))
+    mse = np.mean((pixels - expected) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255**2 / mse)
+
+
+def render_pairs(seeds: range, size: Optional[int] = None) -> tuple[list[Image.Image], float]:
+    """Render the duckies and manduckies of the seeds at the given size, along with the time it took."""
+    images = []
+    start = time.perf_counter()
+    for seed in seeds:
+        rng = random.Random(seed)
+        ducky = make_ducky(seed=rng, size=size)
+        images += [ducky.image, make_manducky(ducky, seed=rng, size=size).image]
+    return images, time.perf_counter() - start
+
+
+def main() -> None:
+    """Compare renders made at every size with full renders resized to the same size."""
+    parser = argparse.ArgumentParser(description="Check the quality and speed of the mip level renders.")
+    parser.add_argument("--seeds", type=int, default=20, help="number of ducky and manducky pairs to compare")
+    args = parser.parse_args()
+
+    seeds = range(args.seeds)
+    preload()
+    # Rendering once first, so the downscaled layers of every level are already built when timing
+    for size in SIZES:
+        render_pairs(seeds, size)
+    full, full_time = render_pairs(seeds)
+
+    print(f"{'size':>5} {'ducky level':>12} {'manducky level':>15} {'min PSNR':>9} {'mean PSNR':>10} {'speedup':>8}")
+    for size in SIZES:
+        images, duration = render_pairs(seeds, size)
+
+        start = time.perf_counter()
+        references = [image.resize(fit_size(image.size, size), Image.LANCZOS) for image in full]
+        resize_time = time.perf_counter() - start
+
+        scores = [psnr(image, reference) for image, reference in zip(images, references)]
+        levels = mip_level(DUCKY_SIZE, size), mip_level(MANDUCKY_SIZE, size)
+        print(
+            f"{size:>5} {levels[0]:>12} {levels[1]:>15} {min(scores):>8.1f}dB {np.mean(scores):>8.1f}dB"
+            f" {(full_time + resize_time) / duration:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()